@@ -1,20 +1,18 @@
-import cProfile
 import gc
-import json
-import multiprocessing
 import os
 import pickle
 import time
 from typing import List, Literal, Optional, Set
 
 import numpy as np
-import pandas as pd
-from matplotlib.ticker import ScalarFormatter
-from shapely import Polygon, Point
-from xgboost import XGBRegressor
-import matplotlib.pyplot as plt
-import polars as pl
 from ValidMesh import ValidMesh
+from Controller.ScenarioGeometry import SCENARIO_FILE, load_geometry
+
+# pedestrian emitting the passive scalar
+SOURCE_ID = 2
+# receivers evaluated with the staff model when a separate student model is given
+STAFF_IDS = [82, 176, 177, 178, 179, 200, 201, 251, 250, 252, 253, 254]
+
 
 def compute_ps_eudist(gridpoints_xy, source_xy, model, eudist_batch, scale=False):
     """
@@ -58,7 +56,7 @@ def compute_ps_eudist(gridpoints_xy, source_xy, model, eudist_batch, scale=False
     #
     # outputs:
     # y_pred_batch: (261,)
-    y_pred_batch_log = model.predict(X_batch)
+    y_pred_batch_log = predict(model, X_batch)
     if scale:
         y_pred_batch_log = y_pred_batch_log * 10
     # convert log value to normal number
@@ -68,11 +66,83 @@ def compute_ps_eudist(gridpoints_xy, source_xy, model, eudist_batch, scale=False
     return np.c_[y_pred_batch, eudist_batch]
 
 
+def predict(model, X_batch):
+    """
+    :param model: XGBoost Booster or sklearn style regressor
+    :param X_batch: (n, 5) rows of source xy, gridpoint xy, eu_dist
+    :return: predicted log10 ps
+    """
+    # the sklearn wrappers already run inplace_predict on dense arrays, with the iteration range of the model
+    if hasattr(model, "inplace_predict"):
+        return model.inplace_predict(X_batch)
+    return model.predict(X_batch)
+
+
+class PredictionQueue:
+    """
+    Feature rows of compute_ps_eudist collected over many frames and evaluated with one predict call per model.
+
+    A single frame only has a few hundred rows per model, at that size the per call overhead of XGBoost dominates the
+    tree evaluation. The predicted ps values are scattered back to the arrays they were queued for once run() is called.
+    """
+
+    def __init__(self, max_rows=1_000_000):
+        """
+        :param max_rows: queued rows after which the queue is run, bounds the memory of the feature rows
+        """
+        self.max_rows = max_rows
+        self.n_rows = 0
+        # (id(model), scale) -> (model, scale, feature rows, (out, index) of every put)
+        self.pending = {}
+
+    def put(self, model, gridpoints_xy, source_xy, eudist_batch, out, index, scale=False):
+        """
+        Queue the rows of compute_ps_eudist(gridpoints_xy, source_xy, model, eudist_batch, scale)
+        :param model:
+        :param gridpoints_xy: (n, 2)
+        :param source_xy: (2,)
+        :param eudist_batch: (n,)
+        :param out: array the ps values are written to
+        :param index: index of out the n ps values are written to
+        :param scale:
+        :return:
+        """
+        X_batch = np.empty((len(gridpoints_xy), 5))
+        X_batch[:, :2] = source_xy
+        X_batch[:, 2:4] = gridpoints_xy
+        X_batch[:, 4] = eudist_batch
+        key = (id(model), scale)
+        if key not in self.pending:
+            self.pending[key] = (model, scale, [], [])
+        self.pending[key][2].append(X_batch)
+        self.pending[key][3].append((out, index))
+        self.n_rows += len(X_batch)
+        if self.n_rows >= self.max_rows:
+            self.run()
+
+    def run(self):
+        """
+        Predict all queued rows and write the ps values to their arrays
+        :return:
+        """
+        for model, scale, features, targets in self.pending.values():
+            y_pred_batch_log = predict(model, np.concatenate(features))
+            if scale:
+                y_pred_batch_log = y_pred_batch_log * 10
+            y_pred_batch = 10 ** y_pred_batch_log
+            start = 0
+            for X_batch, (out, index) in zip(features, targets):
+                out[index] = y_pred_batch[start:start + len(X_batch)]
+                start += len(X_batch)
+        self.pending.clear()
+        self.n_rows = 0
+
+
 class PassiveScalarModel(object):
 
     def __init__(self, n_coors=2, length_grid=0.1, n_receivers=29, n_agents=30, sim_duration_seconds=900,
                  translation_vector=(-11.65, -4.5),
-                 target_locations="../target_center2.json"):
+                 scenario_file=SCENARIO_FILE):
         self.translation_vector = translation_vector
         self.sim_duration_seconds = sim_duration_seconds
         self.n_agents = n_agents
@@ -81,7 +151,7 @@ class PassiveScalarModel(object):
         self.n_receivers = n_agents - 1
         self.n_gridpoints_per_agent = (self.n_coors * 2 + 1) ** 2
         self.n_total_gridpoints = self.n_gridpoints_per_agent * self.n_receivers
-        self.target_locations = target_locations
+        self.geometry = load_geometry(scenario_file)
         self.meshes = ValidMesh()
         self.meshes.set_polygon()
 
@@ -112,9 +182,7 @@ class PassiveScalarModel(object):
         return output_arr
 
     def process_data_vector(self, data, save=None):
-        target_dict = {}
-        with open(self.target_locations) as f:
-            target_dict = json.load(f)
+        import pandas as pd
 
         # add new columns for directional vectors
 
@@ -131,7 +199,7 @@ class PassiveScalarModel(object):
 
         # Extract positions where targetId is valid
         valid_indices = np.where(valid_targets)[0]
-        target_positions = np.array([target_dict.get(str(tid), (0, 1)) for tid in target_ids[valid_targets]])
+        target_positions = self.geometry.centres_of(target_ids[valid_targets].values, default=(0, 1))
         # Vx_starting = [x[0] for x in list(AGENT_HEADING_STARTING.values())]
         # Vy_starting = [x[1] for x in list(AGENT_HEADING_STARTING.values())]
         Vx_starting = [0] * self.n_agents
@@ -145,30 +213,12 @@ class PassiveScalarModel(object):
         # translation to match ps model
         df.drop(["targetId-PID8"], inplace=True, axis=1)
 
-        # Room boundaries (x_min, x_max, y_min, y_max)
-        staff_room = (8.8, 11.75, 0, 4.0)
-        principal_room = (11.9, 14.95, 0, 4.0)
-        kitchen_1 = (19.15, 20.75, 8.25, 9.85)
-        kitchen_2 = (20.75, 23.65, 8.25, 10.6)
-        toilet = (7.3, 11.5, 9.05, 12.05)
-        x = df["x_offset-PID7"].values
-        y = df["y_offset-PID7"].values
-        # Boolean masks for each room
-        in_staff = (x > staff_room[0]) & (x < staff_room[1]) & (y > staff_room[2]) & (y < staff_room[3])
-        in_principal = (x > principal_room[0]) & (x < principal_room[1]) & (y > principal_room[2]) & (
-                y < principal_room[3])
-        in_kitchen_1 = (x > kitchen_1[0]) & (x < kitchen_1[1]) & (y > kitchen_1[2]) & (y < kitchen_1[3])
-        in_kitchen_2 = (x > kitchen_2[0]) & (x < kitchen_2[1]) & (y > kitchen_2[2]) & (y < kitchen_2[3])
-        in_toilet = (x > toilet[0]) & (x < toilet[1]) & (y > toilet[2]) & (y < toilet[3])
-        # Start with "BigRoom" as default
-        room_labels = np.full(len(df), 0, dtype=int)
-
-        # Assign room names using masks
-        room_labels[in_staff] = 1
-        room_labels[in_principal] = 2
-        room_labels[in_kitchen_1] = 3
-        room_labels[in_kitchen_2] = 3
-        room_labels[in_toilet] = 4
+        # Room of every row from the room outlines, agents standing at a target inside a pillar (e.g. the toilet
+        # stalls) belong to the room around it: 0 BigRoom, 1 staff room, 2 principal room, 3 kitchen, 4 toilet
+        positions = df[["x_offset-PID7", "y_offset-PID7"]].to_numpy(dtype=np.float64)
+        room_labels = self.meshes.classify_rooms(positions, self.translation_vector)
+        # rows outside every room (walls, door frames) count as BigRoom like before
+        room_labels[room_labels < 0] = 0
         df["room"] = room_labels
 
         if save:
@@ -184,8 +234,12 @@ class PassiveScalarModel(object):
 
     def compute_ps_pl(self, filename, model, outputfile1, outputfile2, save=True, check_dim=False, new_model=None,
                       student_model=None, batch_size=10000, output_format: Literal["parquet", "csv", "both"] = "csv",
-                      raw=None, source_save=None):
-        # Temporary buffers to accumulate batch data
+                      raw=None, source_save=None, max_prediction_rows=1_000_000):
+        # pandas and polars take most of the import time, only load them once there is data to process
+        import pandas as pd
+        import polars as pl
+
+        # Temporary buffers to accumulate batch data, one array per frame and column
         batch_data = {
             'frame': [],
             'id': [],
@@ -206,10 +260,17 @@ class PassiveScalarModel(object):
         if os.path.exists(intermediate_parquet):
             os.remove(intermediate_parquet)
 
+        # ps predictions of all frames of the batch, run before the batch is written
+        predictions = PredictionQueue(max_prediction_rows)
+
         def flush_batch(batch_idx):
             if not batch_data['frame']:
                 return
-            df_batch = pl.DataFrame(batch_data)
+            predictions.run()
+            columns = {key: np.concatenate(arrays) for key, arrays in batch_data.items()}
+            # ps_at_point holds the per receiver values, repeat them for each grid point of the receiver
+            columns['ps_at_point'] = np.repeat(columns['ps_at_point'], self.n_gridpoints_per_agent)
+            df_batch = pl.DataFrame(columns)
             temp_file = intermediate_parquet.replace(".parquet", f"_batch{batch_idx}.parquet")
             df_batch.write_parquet(temp_file)
             temp_files.append(temp_file)
@@ -221,18 +282,24 @@ class PassiveScalarModel(object):
         batch_count = 0
         b_frames = 0
         data = pd.read_csv(filename, delim_whitespace=True)
-        n_frames = data["timeStep"].unique()
 
         # frame, id, x,y,x_heading, y_heading, room
         processed_data = self.process_data_vector(data)
 
         # free original dataframe
         del data
+        # group the rows by frame once, frame k is processed_data[frame_starts[k]:frame_starts[k + 1]]
+        processed_data = processed_data[np.argsort(processed_data[:, 0], kind="stable")]
+        n_frames, frame_starts = np.unique(processed_data[:, 0], return_index=True)
+        frame_starts = np.append(frame_starts, len(processed_data))
+        # per row invariants, sliced per frame below
+        row_ids = processed_data[:, 1].astype(int)
+        row_is_source = row_ids == SOURCE_ID
+        row_is_staff = np.isin(row_ids, STAFF_IDS)
         # 0: prepare position data
         # read the position of emitter
         time_now = time.time()
-        source_data = processed_data[:, 1].astype(int) == 2
-        source_data = processed_data[source_data]
+        source_data = processed_data[row_is_source]
         source_df = pl.DataFrame(source_data,
                                  schema=['frame', 'id', 'pos_x', 'pos_y', 'x_heading', 'y_heading', 'room'])
         if source_save:
@@ -241,14 +308,14 @@ class PassiveScalarModel(object):
             if output_format in ["csv", "both"]:
                 source_df.write_csv(source_save, separator=';')
         del source_df
-        for f in n_frames:
+        for k, f in enumerate(n_frames):
 
             # Extract all rows for this timestep
-            frame_mask = processed_data[:, 0] == f
-            frame_data = processed_data[frame_mask]
+            frame_rows = slice(frame_starts[k], frame_starts[k + 1])
+            frame_data = processed_data[frame_rows]
 
-            # Find source agent (agentId == 2)
-            source_mask = frame_data[:, 1].astype(int) == 2
+            # Find source agent (agentId == SOURCE_ID)
+            source_mask = row_is_source[frame_rows]
             if not np.any(source_mask):
                 continue
 
@@ -260,6 +327,7 @@ class PassiveScalarModel(object):
             # Get receivers (all agents except source)
             receivers_mask = ~source_mask
             receivers_data = frame_data[receivers_mask]
+            receivers_staff = row_is_staff[frame_rows][receivers_mask]
             receivers_xy = receivers_data[:, 2:6].astype(float)
             receivers_room = receivers_data[:, -1]
             n_receivers = len(receivers_data)
@@ -270,89 +338,61 @@ class PassiveScalarModel(object):
             src_pt_batch = np.c_[source_batch, gridpoints_xy]
             temp_ps_eudist[:, 1] = np.linalg.norm(src_pt_batch[:, :2] - src_pt_batch[:, 2:], axis=1)
             valid_gridpoints = np.ones(self.n_total_gridpoints, dtype=bool)
+            # view of the ps column the queued predictions are written to
+            temp_ps = temp_ps_eudist[:, 0]
 
             # Expand receiver_room info to match grid points
             expanded_receivers_room = np.repeat(receivers_room, self.n_gridpoints_per_agent)
-            expanded_receiver_ids = np.repeat(receivers_data[:, 1], self.n_gridpoints_per_agent)
+            expanded_receivers_staff = np.repeat(receivers_staff, self.n_gridpoints_per_agent)
+            # a grid point is valid if it lies in the room of its receiver, one label raster gather for the frame
+            in_receiver_room = self.meshes.get_valid_mesh_batch(gridpoints_xy, expanded_receivers_room)
             # Case 0: BigRoom (e.g. source_room == 0 or 4)
             if source_room == 0 or source_room == 4:
                 idx_0 = expanded_receivers_room == 0
                 idx_4 = expanded_receivers_room == 4
 
-                mesh_0 = self.meshes.valid_meshes[0]
-                mesh_4 = self.meshes.valid_meshes[4]
-
-                if mesh_0 is not None and np.any(idx_0):
-                    valid_gridpoints[idx_0] = [self.meshes.get_valid_mesh((x, y), mesh_0) for x, y in
-                                               gridpoints_xy[idx_0]]
-
-                if mesh_4 is not None and np.any(idx_4):
-                    valid_gridpoints[idx_4] = [
-                        self.meshes.get_valid_mesh((x, y), mesh_4) for x, y in gridpoints_xy[idx_4]
-                    ]
+                valid_gridpoints[idx_0] = in_receiver_room[idx_0]
+                valid_gridpoints[idx_4] = in_receiver_room[idx_4]
 
                 valid_mask = valid_gridpoints & (idx_0 | idx_4)
 
                 if np.any(valid_mask):
-                    receiver_ids_mask = np.isin(expanded_receiver_ids,
-                                                [82, 176, 177, 178, 179, 200, 201, 251, 250, 252, 253, 254])
-                    staff_mask = valid_mask & receiver_ids_mask
-                    student_mask = valid_mask & ~receiver_ids_mask
+                    staff_mask = valid_mask & expanded_receivers_staff
+                    student_mask = valid_mask & ~expanded_receivers_staff
                     if student_model:
                         if np.any(staff_mask):
-                            filtered_xy = gridpoints_xy[staff_mask]
-                            filtered_eudist = temp_ps_eudist[staff_mask, 1]
-                            out = compute_ps_eudist(filtered_xy, source_xy, model, filtered_eudist)
-                            temp_ps_eudist[staff_mask] = out
+                            predictions.put(model, gridpoints_xy[staff_mask], source_xy,
+                                            temp_ps_eudist[staff_mask, 1], temp_ps, staff_mask)
 
                         if np.any(student_mask):
-                            filtered_xy = gridpoints_xy[student_mask]
-                            filtered_eudist = temp_ps_eudist[student_mask, 1]
-                            out = compute_ps_eudist(filtered_xy, source_xy, student_model, filtered_eudist)
-                            temp_ps_eudist[student_mask] = out
+                            predictions.put(student_model, gridpoints_xy[student_mask], source_xy,
+                                            temp_ps_eudist[student_mask, 1], temp_ps, student_mask)
                     else:
-                        filtered_xy = gridpoints_xy[valid_mask]
-                        filtered_eudist = temp_ps_eudist[valid_mask, 1]
-                        out = compute_ps_eudist(filtered_xy, source_xy, model, filtered_eudist)
-                        temp_ps_eudist[valid_mask] = out
+                        predictions.put(model, gridpoints_xy[valid_mask], source_xy,
+                                        temp_ps_eudist[valid_mask, 1], temp_ps, valid_mask)
 
             # Case 3: Kitchen (use new model)
             elif source_room == 3:
                 idx_3 = expanded_receivers_room == 3
 
-                mesh_3 = self.meshes.valid_meshes[3]
-
-                if mesh_3 is not None and np.any(idx_3):
-                    valid_gridpoints[idx_3] = [self.meshes.get_valid_mesh((x, y), mesh_3) for x, y in
-                                               gridpoints_xy[idx_3]]
+                valid_gridpoints[idx_3] = in_receiver_room[idx_3]
                 valid_mask = valid_gridpoints & idx_3
                 if np.any(valid_mask):
-                    filtered_xy = gridpoints_xy[valid_mask]
-                    filtered_eudist = temp_ps_eudist[valid_mask, 1]
-                    out = compute_ps_eudist(filtered_xy, source_xy, new_model,
-                                            filtered_eudist, True)
-                    temp_ps_eudist[valid_mask] = out
+                    predictions.put(new_model, gridpoints_xy[valid_mask], source_xy,
+                                    temp_ps_eudist[valid_mask, 1], temp_ps, valid_mask, scale=True)
 
             # Case 2: principal room— static value
             elif source_room == 2:
                 idx_2 = expanded_receivers_room == 2
 
-                mesh_2 = self.meshes.valid_meshes[2]
-
-                if mesh_2 is not None and np.any(idx_2):
-                    valid_gridpoints[idx_2] = [self.meshes.get_valid_mesh((x, y), mesh_2) for x, y in
-                                               gridpoints_xy[idx_2]]
+                valid_gridpoints[idx_2] = in_receiver_room[idx_2]
                 temp_ps_eudist[:, 0] = np.where(idx_2, 0.000165, 0.0)
 
             # Case 1: staff room — static value
             elif source_room == 1:
                 idx_1 = expanded_receivers_room == 1
 
-                mesh_1 = self.meshes.valid_meshes[1]
-
-                if mesh_1 is not None and np.any(idx_1):
-                    valid_gridpoints[idx_1] = [self.meshes.get_valid_mesh((x, y), mesh_1) for x, y in
-                                               gridpoints_xy[idx_1]]
+                valid_gridpoints[idx_1] = in_receiver_room[idx_1]
                 temp_ps_eudist[:, 0] = np.where(idx_1, 0.000162, 0.0)
             # Broadcast frame index
             # reset n_receivers
@@ -384,29 +424,24 @@ class PassiveScalarModel(object):
 
                 valid_mask = idx_0 | idx_4
                 if np.any(valid_mask):
-                    receiver_ids_mask = np.isin(receiver_ids,
-                                                [82, 176, 177, 178, 179, 200, 201, 251, 250, 252, 253, 254])
-                    staff_mask = valid_mask & receiver_ids_mask
-                    student_mask = valid_mask & ~receiver_ids_mask
+                    staff_mask = valid_mask & receivers_staff
+                    student_mask = valid_mask & ~receivers_staff
                     if student_model:
                         if np.any(staff_mask):
-                            receiver_ps[staff_mask] = compute_ps_eudist(
-                                receivers_xy[staff_mask, :2], source_xy, model, receiver_dist[staff_mask]
-                            )[:, 0]
+                            predictions.put(model, receivers_xy[staff_mask, :2], source_xy,
+                                            receiver_dist[staff_mask], receiver_ps, staff_mask)
                         if np.any(student_mask):
-                            receiver_ps[student_mask] = compute_ps_eudist(
-                                receivers_xy[student_mask, :2], source_xy, student_model,
-                                receiver_dist[student_mask]
-                            )[:, 0]
+                            predictions.put(student_model, receivers_xy[student_mask, :2], source_xy,
+                                            receiver_dist[student_mask], receiver_ps, student_mask)
                     else:
-                        receiver_ps[valid_mask] = compute_ps_eudist(receivers_xy[valid_mask, :2], source_xy, model,
-                                                                    receiver_dist[valid_mask])[:, 0]
+                        predictions.put(model, receivers_xy[valid_mask, :2], source_xy,
+                                        receiver_dist[valid_mask], receiver_ps, valid_mask)
 
             elif source_room == 3:
                 mask = receivers_room == 3
-                receiver_ps[mask] = compute_ps_eudist(receivers_xy[mask, :2], source_xy, new_model, receiver_dist[mask],
-                                                      True)[:,
-                                    0]
+                if np.any(mask):
+                    predictions.put(new_model, receivers_xy[mask, :2], source_xy, receiver_dist[mask], receiver_ps,
+                                    mask, scale=True)
 
             elif source_room == 2:
                 receiver_ps = np.where(receivers_room == 2, 0.000165, 0.0)
@@ -414,21 +449,19 @@ class PassiveScalarModel(object):
             elif source_room == 1:
                 receiver_ps = np.where(receivers_room == 1, 0.000162, 0.0)
 
-            # Repeat ps_at_point for each grid point of the receiver
-            ps_at_point_expanded = np.repeat(receiver_ps, self.n_gridpoints_per_agent)
             receiver_dist_expanded = np.repeat(receiver_dist, self.n_gridpoints_per_agent)
-            # Flatten PS and EuDist arrays
-            batch_data['frame'].extend(temp_frame)
-            batch_data['id'].extend(temp_id)
-            batch_data['room'].extend(expanded_receivers_room)
-            batch_data['pos_x'].extend(temp_x)
-            batch_data['pos_y'].extend(temp_y)
-            batch_data['eu_dist'].extend(temp_ps_eudist[:, 1])
-            batch_data['dist'].extend(temp_dist)
-            batch_data['ps_raw'].extend(temp_ps_eudist[:, 0])
-            batch_data['valid'].extend(valid_gridpoints)
-            batch_data['ps_at_point'].extend(ps_at_point_expanded)
-            batch_data['dist_at_point'].extend(receiver_dist_expanded)
+            # ps values may still be queued, they are filled in before the batch is flushed
+            batch_data['frame'].append(temp_frame)
+            batch_data['id'].append(temp_id)
+            batch_data['room'].append(expanded_receivers_room)
+            batch_data['pos_x'].append(temp_x)
+            batch_data['pos_y'].append(temp_y)
+            batch_data['eu_dist'].append(temp_ps_eudist[:, 1])
+            batch_data['dist'].append(temp_dist)
+            batch_data['ps_raw'].append(temp_ps)
+            batch_data['valid'].append(valid_gridpoints)
+            batch_data['ps_at_point'].append(receiver_ps)
+            batch_data['dist_at_point'].append(receiver_dist_expanded)
             # Periodically flush batch to parquet to save memory
 
             if b_frames >= batch_size:
@@ -1,15 +1,134 @@
+"""
+Rooms of the floor plan as label rasters, one over the walkable areas and one over the room outlines.
+
+Rasterizing the polygons takes millions of point in polygon tests, so the rasters are saved under RASTER_CACHE_DIR
+keyed by a hash of the polygons and the resolution. Later runs memory map them read only, which costs nothing at
+start-up and lets forked workers share the same pages.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
 import numpy as np
-import matplotlib.pyplot as plt
-from shapely.geometry import Polygon
-from shapely import vectorized
+
+from ProjectConstants import PROJECT_PATH
+
+RESOLUTION = 0.01
+RASTER_CACHE_DIR = PROJECT_PATH / ".cache" / "valid_mesh"
+
+_loaded = {}
+
+
+def polygons_hash(polygons, resolution):
+    digest = hashlib.sha256(repr(resolution).encode())
+    for polygon in polygons:
+        digest.update(polygon.wkb)
+    return digest.hexdigest()[:16]
+
+
+def cached_raster(name, polygons, resolution, build, cache_dir=RASTER_CACHE_DIR):
+    """
+    Load a label raster of polygons memory mapped read only, building and saving it first if the polygons or the
+    resolution changed since the last build
+    :param name: prefix of the artifact, older artifacts with the same prefix are removed
+    :param polygons: polygons the raster is built from
+    :param resolution:
+    :param build: function returning the labels of the raster
+    :param cache_dir: directory holding the artifacts
+    :return: read only np.memmap
+    """
+    key = f"{name}-{polygons_hash(polygons, resolution)}"
+    if key in _loaded:
+        return _loaded[key]
+
+    artifact = Path(cache_dir) / f"{key}.npy"
+    if not artifact.exists():
+        labels = build()
+        artifact.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so that concurrent runs never see a partial artifact
+        fd, tmp = tempfile.mkstemp(suffix=".npy", dir=artifact.parent)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, labels)
+        os.replace(tmp, artifact)
+        for stale in artifact.parent.glob(f"{name}-*.npy"):
+            if stale != artifact:
+                stale.unlink(missing_ok=True)
+    _loaded[key] = np.load(artifact, mmap_mode="r")
+    return _loaded[key]
+
+
+def raster_bounds(polygons):
+    """
+    :param polygons:
+    :return: (minx, miny, maxx, maxy) over all polygons
+    """
+    all_bounds = np.array([polygon.bounds for polygon in polygons])
+    minx, miny = all_bounds[:, :2].min(axis=0)
+    maxx, maxy = all_bounds[:, 2:].max(axis=0)
+    return minx, miny, maxx, maxy
+
+
+def rasterize_labels(polygons, resolution=RESOLUTION):
+    """
+    One raster over all polygons, every cell holds 1 + the index of the polygon containing it or 0 if it is in none.
+    Later polygons are painted over earlier ones.
+    :param polygons:
+    :param resolution:
+    :return: (uint8 labels, bounds, resolution)
+    """
+    from shapely import vectorized
+
+    minx, miny, maxx, maxy = raster_bounds(polygons)
+    width = int((maxx - minx) / resolution) + 1
+    height = int((maxy - miny) / resolution) + 1
+    labels = np.zeros((height, width), dtype=np.uint8)
+
+    for index, polygon in enumerate(polygons):
+        # only sample the cells of the polygon's bounding box
+        p_minx, p_miny, p_maxx, p_maxy = polygon.bounds
+        ix0, iy0 = int((p_minx - minx) / resolution), int((p_miny - miny) / resolution)
+        ix1 = min(width, int((p_maxx - minx) / resolution) + 2)
+        iy1 = min(height, int((p_maxy - miny) / resolution) + 2)
+        xx, yy = np.meshgrid(minx + np.arange(ix0, ix1) * resolution, miny + np.arange(iy0, iy1) * resolution)
+        inside = vectorized.contains(polygon, xx.ravel(), yy.ravel()).reshape(xx.shape)
+        labels[iy0:iy1, ix0:ix1][inside] = index + 1
+
+    return labels, (minx, miny, maxx, maxy), resolution
+
+
+def lookup_labels(raster, points, translation_vector=None):
+    """
+    :param raster: (labels, bounds, resolution) as returned by rasterize_labels
+    :param points: (N, 2) array of positions
+    :param translation_vector:
+    :return: index of the polygon containing every point, -1 for points in none of them
+    """
+    labels, bounds, resolution = raster
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if translation_vector is not None:
+        points = points + np.asarray(translation_vector)
+    minx, miny, maxx, maxy = bounds
+    # astype truncates towards zero like int()
+    ix = ((points[:, 0] - minx) / resolution).astype(np.int64)
+    iy = ((points[:, 1] - miny) / resolution).astype(np.int64)
+
+    inside = (ix >= 0) & (ix < labels.shape[1]) & (iy >= 0) & (iy < labels.shape[0])
+    ids = np.full(len(points), -1, dtype=np.int64)
+    ids[inside] = labels[iy[inside], ix[inside]].astype(np.int64) - 1
+    return ids
 
 
 class ValidMesh:
 
     def __init__(self):
-        self.valid_meshes = []
+        self.polygons = []
+        self.label_raster = None
+        self.room_raster = None
 
     def set_polygon(self):
+        from shapely.geometry import Polygon
+
         # --- Your polygon setup ---
 
         shift_x = -11.65
@@ -139,51 +258,70 @@ class ValidMesh:
         kitchen_polygon = Polygon(kitchen_shifted, k_holes)
 
         # --- Rasterization setup ---
-
-        def rasterize_polygon(polygon, resolution=0.01):
-            minx, miny, maxx, maxy = polygon.bounds
-            width = int((maxx - minx) / resolution) + 1
-            height = int((maxy - miny) / resolution) + 1
-
-            x_coords = np.linspace(minx, maxx, width)
-            y_coords = np.linspace(miny, maxy, height)
-
-            xx, yy = np.meshgrid(x_coords, y_coords)
-            points = np.vstack((xx.ravel(), yy.ravel())).T
-
-            mask_flat = vectorized.contains(polygon, points[:, 0], points[:, 1])
-            mask = mask_flat.reshape((height, width))
-
-            return mask, (minx, miny, maxx, maxy), resolution
-
-        mask_big_room = rasterize_polygon(polygon_big_room)
-        mask_toilet = rasterize_polygon(toilet_polygon)
-        mask_kitchen = rasterize_polygon(kitchen_polygon)
-        mask_staff = rasterize_polygon(staff_polygon)
-        mask_principal = rasterize_polygon(principal_polygon)
-
-        self.valid_meshes = [mask_big_room, mask_staff, mask_principal, mask_kitchen, mask_toilet]
-
-    @staticmethod
-    def get_valid_mesh(pos, mesh, translation_vector=None):
-        x_t, y_t = pos
-        mask, bounds, resolution = mesh
-        # Apply translation
-        if translation_vector is not None:
-            x_t, y_t = x_t + translation_vector[0], y_t + translation_vector[1]
-        minx, miny, maxx, maxy = bounds
-        ix = int((x_t - minx) / resolution)
-        iy = int((y_t - miny) / resolution)
-
-        # Default result
-        result = False
-
-        if 0 <= ix < mask.shape[1] and 0 <= iy < mask.shape[0]:
-            result = bool(mask[iy, ix])
-        return result
+        # the label rasters are loaded on first use
+
+        # room ids are the indices in this list: 0 big room, 1 staff, 2 principal, 3 kitchen, 4 toilet
+        self.polygons = [polygon_big_room, staff_polygon, principal_polygon, kitchen_polygon, toilet_polygon]
+        self.label_raster = None
+        self.room_raster = None
+
+    def get_label_raster(self):
+        """
+        :return: (labels, bounds, resolution), labels hold 1 + room id for every walkable cell of a room, 0 elsewhere
+        """
+        if self.label_raster is None:
+            labels = cached_raster("labels", self.polygons, RESOLUTION,
+                                 lambda: rasterize_labels(self.polygons, RESOLUTION)[0])
+            self.label_raster = labels, raster_bounds(self.polygons), RESOLUTION
+        return self.label_raster
+
+    def get_room_raster(self):
+        """
+        Label raster of the room outlines, the pillars are filled in and count as part of their room
+        :return: (labels, bounds, resolution)
+        """
+        if self.room_raster is None:
+            from shapely.geometry import Polygon
+
+            outlines = [Polygon(polygon.exterior) for polygon in self.polygons]
+            labels = cached_raster("rooms", outlines, RESOLUTION, lambda: rasterize_labels(outlines, RESOLUTION)[0])
+            self.room_raster = labels, raster_bounds(outlines), RESOLUTION
+        return self.room_raster
+
+    def get_room_ids(self, points, translation_vector=None):
+        """
+        Walkable room of every point, looked up in the label raster with one gather
+        :param points: (N, 2) array of positions
+        :param translation_vector:
+        :return: room id of every point, -1 for points outside every room or inside a pillar
+        """
+        return lookup_labels(self.get_label_raster(), points, translation_vector)
+
+    def classify_rooms(self, points, translation_vector=None):
+        """
+        Room of every point by the room outlines, a point inside a pillar belongs to the room around the pillar
+        :param points: (N, 2) array of positions
+        :param translation_vector:
+        :return: room id of every point, -1 for points outside every room
+        """
+        return lookup_labels(self.get_room_raster(), points, translation_vector)
+
+    def get_valid_mesh_batch(self, points, rooms, translation_vector=None):
+        """
+        Check every point against its room in the label raster
+        :param points: (N, 2) array of positions
+        :param rooms: (N,) room ids, the index of the room in polygons
+        :param translation_vector:
+        :return: boolean array
+        """
+        return self.get_room_ids(points, translation_vector) == np.asarray(rooms).astype(np.int64)
 
 
 def test_polygon_walkable_mask(self):
+    import matplotlib.pyplot as plt
+    from shapely.geometry import Polygon
+    from shapely import vectorized
+
     # --- Your polygon setup ---
 
     shift_x = -11.65
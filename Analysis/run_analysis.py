@@ -1,4 +1,4 @@
-from aiofiles import os
+import os
 
 from PassiveScalarModel import PassiveScalarModel
 import pickle
@@ -9,7 +9,7 @@ ANALYSIS_PATH = os.path.join(PROJECT_PATH, "results")
 
 
 def analyse_specific_pl(start1=0, end1=100):
-    t = PassiveScalarModel(n_agents=85, target_locations=f"{PROJECT_PATH}/target_center_daily_with_table.json")
+    t = PassiveScalarModel(n_agents=85)
     filename = f'{PROJECT_PATH}/ps_model/data_model_emitter_standing_receiver_standing.p'
     filename1 = f'{PROJECT_PATH}/ps_model/kitchen_emitter_standing_receiver_standing.p'
     filename2 = f'{PROJECT_PATH}/ps_model/data_model_emitter_standing_receiver_sitting.p'
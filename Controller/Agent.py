@@ -1,40 +1,61 @@
 from __future__ import annotations
 
 import abc
-import random
+import heapq
+import math
 from typing import TYPE_CHECKING
-from queue import PriorityQueue
-
-import numpy as np
 
 from Controller import Constants, DailyConstants
 
 from Controller.Constants import ToiletState
-from Controller.DailyConstants import StaffStatus, StudentStatus, ActivityType, AREA_DICT, BREAK_ROOM, KITCHENETTE, \
+from Controller.DailyConstants import StaffStatus, StudentStatus, ActivityType, BREAK_ROOM, KITCHENETTE, \
     EventState, STAFF_NAP_TIME_STATUS, PrincipalStatus, PRINCIPAL_TABLE, EXIT, \
     INTERMEDIATE_TOILET_TARGET, CLASSROOM_5, CLASSROOM_6, INTERMEDIATE_TOILET_TARGET_POS, \
     INTERMEDIATE_TOILET_TARGET_2_POS, INTERMEDIATE_TOILET_TARGET_2, CLASSROOM_3, STAFF_HANGOUT_SPOT_BREAK_ROOM, \
     STAFF_HANGOUT_SPOT_KITCHENETTE, StaffType
-from Controller.SeatManager import TableSeatManager, PrincipalRoomManager
-from Controller.Singleton import Singleton
+from Controller.Layout import FILTERED_AREA, AREA_MEMBERS
+from Controller.RandomSource import RandomStream
 from Controller.func import euclidean_distance
 
 if TYPE_CHECKING:
     from Controller.ClassManager import Class, ClassManager
+    from Controller.SimulationContext import SimulationContext
+
 
+class TargetPriorityQueue:
+    """
+    Targets ordered by priority, first in first out among equal priorities.
+
+    A plain heap of (priority, counter, target) entries, the simulation is single threaded so none of the locking
+    of queue.PriorityQueue is needed.
+    """
+    __slots__ = ("heap", "counter")
 
-class TargetPriorityQueue(PriorityQueue):
     def __init__(self):
-        PriorityQueue.__init__(self)
+        self.heap = []
         self.counter = 0
 
     def put(self, item, priority):
-        PriorityQueue.put(self, (priority, self.counter, item))
+        heapq.heappush(self.heap, (priority, self.counter, item))
         self.counter += 1
 
-    def get(self, *args, **kwargs):
-        _, _, item = PriorityQueue.get(self, *args, **kwargs)
-        return item
+    def get(self):
+        return heapq.heappop(self.heap)[2]
+
+    def peek(self):
+        """
+        :return: the target get would return, without removing it
+        """
+        return self.heap[0][2]
+
+    def clear(self):
+        self.heap = []
+
+    def empty(self):
+        return not self.heap
+
+    def __len__(self):
+        return len(self.heap)
 
 
 class Agent(object):
@@ -42,9 +63,10 @@ class Agent(object):
     Represents an agent with its current state in the simulation
     """
 
-    def __init__(self, ped_id, chair, targets):
+    def __init__(self, ped_id, chair, targets, rng=None):
         self.ped_id = ped_id
-        self.interest_stack = PriorityQueue()
+        self.rng = rng if rng is not None else RandomStream()
+        self.interest_stack = TargetPriorityQueue()
         self.current_target = chair
         self.chair = chair
         self.targets = targets
@@ -52,9 +74,9 @@ class Agent(object):
         # put the targets in the interest stack
         for target in targets:
             if target == Constants.TABLE:
-                self.interest_stack.put((1, chair))
+                self.interest_stack.put(chair, 1)
             elif target != Constants.TOILET_ENTRANCE:
-                self.interest_stack.put((1, target))
+                self.interest_stack.put(target, 1)
             else:
                 self.change_toilet_state(Constants.ToiletState.WANT_TO_GO_TOILET)
 
@@ -70,23 +92,22 @@ class Agent(object):
 
         # Empty interest stack when ending
         if sim_time >= Constants.ENDING_TIME and not self.end_status:
-            self.target_end_time = sim_time + max(0, np.random.normal(30, 20))
+            self.target_end_time = sim_time + max(0, self.rng.normal(30, 20))
             self.end_status = True
-            while not self.interest_stack.empty():
-                self.interest_stack.get()
+            self.interest_stack.clear()
             return
         if not self.interest_stack.empty():
-            self.current_target = self.interest_stack.get()[1]
+            self.current_target = self.interest_stack.get()
             if self.current_target in Constants.DENSITY_AREA_DICT[Constants.SUBGROUP_R]:
-                self.target_end_time = sim_time + max(0, np.random.normal(740, 10))
+                self.target_end_time = sim_time + max(0, self.rng.normal(740, 10))
             elif self.current_target in Constants.DENSITY_AREA_DICT[Constants.SUBGROUP_T]:
-                self.target_end_time = sim_time + max(0, np.random.normal(250, 10))
+                self.target_end_time = sim_time + max(0, self.rng.normal(250, 10))
             elif self.current_target in Constants.DENSITY_AREA_DICT[Constants.SUBGROUP_B]:
-                self.target_end_time = sim_time + max(0, np.random.normal(150, 10))
+                self.target_end_time = sim_time + max(0, self.rng.normal(150, 10))
             elif self.current_target in Constants.DENSITY_AREA_DICT[Constants.SUBGROUP_RR]:
-                self.target_end_time = sim_time + max(0, np.random.normal(740, 10))
+                self.target_end_time = sim_time + max(0, self.rng.normal(740, 10))
             else:
-                self.target_end_time = sim_time + max(0, np.random.normal(60, 10))
+                self.target_end_time = sim_time + max(0, self.rng.normal(60, 10))
         else:
             self.current_target = self.chair
 
@@ -102,7 +123,7 @@ class Agent(object):
         return self.target_end_time is not None and sim_time >= self.target_end_time
 
     def add_target(self, target, priority):
-        self.interest_stack.put((priority, target))
+        self.interest_stack.put(target, priority)
 
     def change_toilet_state(self, state):
         self.toilet_state = state
@@ -121,18 +142,21 @@ class BaseAgent(object):
     Base Class for childcare daily activities scenario
     """
 
-    def __init__(self, ped_id, targets, bladder_cap, class_id):
+    def __init__(self, ped_id, targets, bladder_cap, class_id, rng=None, context=None):
         self.ped_id = ped_id
+        self.rng = rng if rng is not None else RandomStream()
+        # SimulationContext the agent belongs to, gives access to the principal and the principal room
+        self.context: SimulationContext = context
         self.targets = targets
         self.interest_stack = TargetPriorityQueue()
         self.toilet_state = Constants.ToiletState.NOT_USING
-        self.current_target = random.choice([x for x in AREA_DICT[class_id] if x != -1])
+        self.current_target = self.rng.choice(FILTERED_AREA[class_id])
         self.bladder_cap = bladder_cap
         self.class_id = class_id
         self.fidget_time = 0.0
         self.status = None
         self.target_end_time = 0.0
-        self.next_toilet_time = np.random.normal(self.bladder_cap, 45)
+        self.next_toilet_time = self.rng.normal(self.bladder_cap, 45)
         self.free_time_activity_end_time = 0
         self.set_to_end = False
         self.toilet_change_target_time = 0
@@ -140,6 +164,8 @@ class BaseAgent(object):
         self.current_pos = (0, 0)
         self.reach_intermediate = False
         self.intermediate_targets = []
+        # set while common_behaviour is letting the agent fidget around randomly
+        self.random_movement = False
 
     def set_next_target(self, sim_time):
         """
@@ -150,10 +176,10 @@ class BaseAgent(object):
         if not self.interest_stack.empty():
             target = self.interest_stack.get()
             self.current_target = target[0]
-            self.target_end_time = sim_time + max(0, np.random.normal(target[1], 2))
+            self.target_end_time = sim_time + max(0, self.rng.normal(target[1], 2))
 
         if self.toilet_state == ToiletState.NOT_USING or self.toilet_state == ToiletState.JUST_ENDED:
-            self.current_target = random.choice([x for x in AREA_DICT[self.class_id] if x != -1])
+            self.current_target = self.rng.choice(FILTERED_AREA[self.class_id])
 
     def set_intermediate_target(self, target, reverse=False, route_to="T"):
         if route_to == "T":
@@ -230,6 +256,7 @@ class BaseAgent(object):
                 self.current_target = current_target[0]
 
     def update_agent_movement(self, c: Class, sim_time: float):
+        self.random_movement = False
         if self.need_go_toilet(
                 sim_time) and self.toilet_state == ToiletState.NOT_USING:
             self.toilet_state = ToiletState.WANT_TO_GO_TOILET
@@ -251,25 +278,50 @@ class BaseAgent(object):
         elif c.event_state == EventState.ALL_FINISHED:
             self.end(c, sim_time)
 
+    def wakeup_signature(self):
+        """
+        Activity state that update_agent_movement can change, an update that leaves it untouched means the agent is
+        idle until next_wakeup_time. Timers are left out, rearming a timer does not make the agent busy.
+        :return:
+        """
+        return self.current_target, self.status, self.toilet_state
+
+    def next_wakeup_time(self, sim_time: float):
+        """
+        Earliest time at which update_agent_movement can do anything for an idle agent, as long as its class stays
+        in the same event state.
+        :param sim_time:
+        :return: sim_time if the agent has to be updated every step
+        """
+        if self.toilet_state != ToiletState.NOT_USING:
+            return sim_time
+        if self.intermediate_targets and not self.reach_intermediate:
+            return sim_time
+        if self.random_movement and self.fidget_time <= sim_time:
+            return sim_time
+        return min((t for t in (self.fidget_time, self.next_toilet_time, self.free_time_activity_end_time)
+                    if t >= sim_time), default=math.inf)
+
     def update_bladder_full_timing(self, sim_time: float):
-        self.next_toilet_time = sim_time + np.random.normal(self.bladder_cap, 45)
+        self.next_toilet_time = sim_time + self.rng.normal(self.bladder_cap, 45)
 
     def need_go_toilet(self, sim_time: float):
         return self.next_toilet_time <= sim_time
 
     def common_behaviour(self, area, status_condition, new_status, sim_time: float, random_movement=False,
                          fidget_time=35, nearby=False, c: Class = None):
+        self.random_movement = random_movement
         if self.status != status_condition:
-            self.current_target = random.choice(area)
+            self.current_target = self.rng.choice(area)
             self.status = new_status
-            self.fidget_time = sim_time + np.random.normal(fidget_time, 2)
+            self.fidget_time = sim_time + self.rng.normal(fidget_time, 2)
         elif random_movement and self.toilet_state == ToiletState.NOT_USING:
-            if random.random() < 0.2 and sim_time >= self.fidget_time:
-                if nearby and self.current_target in AREA_DICT[self.class_id]:
-                    self.current_target = random.choice(c.find_nearby_grid_by_id(self.current_target))
+            if self.rng.random() < 0.2 and sim_time >= self.fidget_time:
+                if nearby and self.current_target in AREA_MEMBERS[self.class_id]:
+                    self.current_target = self.rng.choice(c.find_nearby_grid_by_id(self.current_target))
                 else:
-                    self.current_target = random.choice(area)
-                self.fidget_time = sim_time + np.random.normal(fidget_time, 2)
+                    self.current_target = self.rng.choice(area)
+                self.fidget_time = sim_time + self.rng.normal(fidget_time, 2)
 
     def prepare_event(self, c: Class, sim_time: float):
         if c.current_event[0] == ActivityType.LESSON:
@@ -310,9 +362,6 @@ class BaseAgent(object):
         elif c.current_event[0] == ActivityType.FREE_CHOICE_ACTIVITY:
             self.prepare_free_choice(c, sim_time)
 
-    def update_position(self, pos):
-        self.current_pos = pos
-
     @abc.abstractmethod
     def prepare_for_lesson(self, c: Class, sim_time: float):
         """
@@ -469,8 +518,9 @@ class StaffAgent(BaseAgent):
     https://pmc.ncbi.nlm.nih.gov/articles/PMC3206217/
     """
 
-    def __init__(self, ped_id, class_id, targets, staff_type=StaffType.CLASS, bladder_cap=14400):
-        super().__init__(ped_id, targets, bladder_cap, class_id)
+    def __init__(self, ped_id, class_id, targets, staff_type=StaffType.CLASS, bladder_cap=14400, rng=None,
+                 context=None):
+        super().__init__(ped_id, targets, bladder_cap, class_id, rng, context)
         self.status = StaffStatus.FREE
         self.chill_spot = None
         self.staff_type = staff_type
@@ -478,8 +528,14 @@ class StaffAgent(BaseAgent):
     def is_free(self):
         return self.status == StaffStatus.FREE
 
+    def next_wakeup_time(self, sim_time: float):
+        # free staff pick a new activity every step and talking staff watch whether the principal is still in office
+        if self.status == StaffStatus.FREE or self.status == StaffStatus.TALKING:
+            return sim_time
+        return super().next_wakeup_time(sim_time)
+
     def prepare_for_lesson(self, c: Class, sim_time: float):
-        self.common_behaviour(DailyConstants.AREA_DICT[BREAK_ROOM], StaffStatus.PREPARING, StaffStatus.PREPARING,
+        self.common_behaviour(FILTERED_AREA[BREAK_ROOM], StaffStatus.PREPARING, StaffStatus.PREPARING,
                               sim_time)
 
     def do_lesson(self, c: Class, sim_time: float):
@@ -487,21 +543,21 @@ class StaffAgent(BaseAgent):
             if self == c.leader:
                 self.current_target = DailyConstants.LEADER_POSITION[self.class_id]
             else:
-                self.current_target = random.choice([x for x in AREA_DICT[self.class_id] if x != -1])
-                self.fidget_time = sim_time + np.random.normal(30, 5)
+                self.current_target = self.rng.choice(FILTERED_AREA[self.class_id])
+                self.fidget_time = sim_time + self.rng.normal(30, 5)
             self.status = StaffStatus.TEACHING
 
         elif self.toilet_state == ToiletState.NOT_USING:
-            if sim_time >= self.fidget_time and random.random() < 0.2 and self != c.leader:
-                if self.current_target in AREA_DICT[self.class_id]:
-                    self.current_target = random.choice(c.find_nearby_grid_by_id(self.current_target))
+            if sim_time >= self.fidget_time and self.rng.random() < 0.2 and self != c.leader:
+                if self.current_target in AREA_MEMBERS[self.class_id]:
+                    self.current_target = self.rng.choice(c.find_nearby_grid_by_id(self.current_target))
                 else:
-                    self.current_target = random.choice([x for x in AREA_DICT[self.class_id] if x != -1])
-            self.fidget_time = sim_time + np.random.normal(60, 5)
+                    self.current_target = self.rng.choice(FILTERED_AREA[self.class_id])
+            self.fidget_time = sim_time + self.rng.normal(60, 5)
 
     def clean_up_for_lesson(self, c: Class, sim_time: float):
         if self.status != StaffStatus.CLEANING_UP and self != c.leader:
-            self.current_target = random.choice(DailyConstants.AREA_DICT[BREAK_ROOM])
+            self.current_target = self.rng.choice(FILTERED_AREA[BREAK_ROOM])
             self.status = StaffStatus.CLEANING_UP
 
     def prepare_for_meal(self, c: Class, sim_time: float):
@@ -514,14 +570,14 @@ class StaffAgent(BaseAgent):
         # need to find a way to do the reverse when going back
         if self.class_id == CLASSROOM_3:
             if self.status != StaffStatus.PREPARING:
-                target = random.choice(DailyConstants.AREA_DICT[KITCHENETTE])
+                target = self.rng.choice(FILTERED_AREA[KITCHENETTE])
                 self.status = StaffStatus.PREPARING
                 self.set_intermediate_target(target, route_to="K")
                 self.intermediate_movement_handler()
             else:
                 self.intermediate_movement_handler()
         else:
-            self.common_behaviour(DailyConstants.AREA_DICT[KITCHENETTE], StaffStatus.PREPARING, StaffStatus.PREPARING,
+            self.common_behaviour(FILTERED_AREA[KITCHENETTE], StaffStatus.PREPARING, StaffStatus.PREPARING,
                                   sim_time)
 
     def do_meal(self, c: Class, sim_time: float):
@@ -532,14 +588,14 @@ class StaffAgent(BaseAgent):
     def clean_up_for_meal(self, c: Class, sim_time: float):
         if self.class_id == CLASSROOM_3:
             if self.status != StaffStatus.CLEANING_UP:
-                target = random.choice(DailyConstants.AREA_DICT[KITCHENETTE])
+                target = self.rng.choice(FILTERED_AREA[KITCHENETTE])
                 self.set_intermediate_target(target, route_to="K")
                 self.intermediate_movement_handler()
                 self.status = StaffStatus.CLEANING_UP
             else:
                 self.intermediate_movement_handler()
         else:
-            self.common_behaviour(DailyConstants.AREA_DICT[KITCHENETTE], StaffStatus.CLEANING_UP,
+            self.common_behaviour(FILTERED_AREA[KITCHENETTE], StaffStatus.CLEANING_UP,
                                   StaffStatus.CLEANING_UP,
                                   sim_time)
 
@@ -550,7 +606,7 @@ class StaffAgent(BaseAgent):
         :param sim_time:
         :return:
         """
-        self.common_behaviour([x for x in AREA_DICT[self.class_id] if x != -1], StaffStatus.PREPARING,
+        self.common_behaviour(FILTERED_AREA[self.class_id], StaffStatus.PREPARING,
                               StaffStatus.PREPARING, sim_time, nearby=True, c=c, random_movement=True)
 
     def do_nap(self, c: Class, sim_time: float):
@@ -570,51 +626,51 @@ class StaffAgent(BaseAgent):
 
         # Choose a random activity to do
         if self.status == StaffStatus.FREE:
-            principal = Principal()
+            principal = self.context.principal
             if principal.in_office():
                 activities_available = STAFF_NAP_TIME_STATUS
             else:
                 activities_available = [x for x in STAFF_NAP_TIME_STATUS if x is not StaffStatus.TALKING]
-            random_activity = random.choice(activities_available)
+            random_activity = self.rng.choice(activities_available)
             if random_activity == StaffStatus.TALKING:
-                principal_room = PrincipalRoomManager()
+                principal_room = self.context.principal_room_manager
                 # check if principal is free first if not go to the next loop first
                 if principal.in_office() and principal_room.is_seat_available():
                     self.current_target = principal_room.assign_seat(self.ped_id)
                     self.status = StaffStatus.TALKING
-                    self.free_time_activity_end_time = sim_time + np.random.normal(450, 60)
+                    self.free_time_activity_end_time = sim_time + self.rng.normal(450, 60)
             elif random_activity == StaffStatus.CHILLING:
                 self.status = StaffStatus.CHILLING
-                self.chill_spot = random.choice([STAFF_HANGOUT_SPOT_BREAK_ROOM, STAFF_HANGOUT_SPOT_KITCHENETTE])
-                self.common_behaviour(AREA_DICT[self.chill_spot], StaffStatus.CHILLING, StaffStatus.CHILLING, sim_time,
-                                      c=c, random_movement=True)
-                self.free_time_activity_end_time = sim_time + np.random.normal(900, 90)
+                self.chill_spot = self.rng.choice([STAFF_HANGOUT_SPOT_BREAK_ROOM, STAFF_HANGOUT_SPOT_KITCHENETTE])
+                self.common_behaviour(FILTERED_AREA[self.chill_spot], StaffStatus.CHILLING, StaffStatus.CHILLING,
+                                      sim_time, c=c, random_movement=True)
+                self.free_time_activity_end_time = sim_time + self.rng.normal(900, 90)
 
             elif random_activity == StaffStatus.BREAK:
                 self.status = StaffStatus.BREAK
-                self.common_behaviour(AREA_DICT[BREAK_ROOM], StaffStatus.BREAK, StaffStatus.BREAK, sim_time)
-                self.free_time_activity_end_time = sim_time + np.random.normal(900, 90)
+                self.common_behaviour(FILTERED_AREA[BREAK_ROOM], StaffStatus.BREAK, StaffStatus.BREAK, sim_time)
+                self.free_time_activity_end_time = sim_time + self.rng.normal(900, 90)
 
             elif random_activity == StaffStatus.TEACHING and self.staff_type == StaffType.CLASS:
                 self.status = StaffStatus.TEACHING
-                self.common_behaviour([x for x in AREA_DICT[self.class_id] if x != -1], StaffStatus.FREE,
+                self.common_behaviour(FILTERED_AREA[self.class_id], StaffStatus.FREE,
                                       StaffStatus.TEACHING, sim_time)
-                self.free_time_activity_end_time = sim_time + np.random.normal(1800, 360)
+                self.free_time_activity_end_time = sim_time + self.rng.normal(1800, 360)
 
         if self.status == StaffStatus.TALKING:
-            principal = Principal()
+            principal = self.context.principal
             if not principal.in_office():
-                principal_room = PrincipalRoomManager()
+                principal_room = self.context.principal_room_manager
                 principal_room.free_seat(self.ped_id)
                 self.status = StaffStatus.FREE
 
         elif self.status == StaffStatus.CHILLING:
-            self.common_behaviour(AREA_DICT[self.chill_spot], StaffStatus.CHILLING, StaffStatus.CHILLING, sim_time,
+            self.common_behaviour(FILTERED_AREA[self.chill_spot], StaffStatus.CHILLING, StaffStatus.CHILLING, sim_time,
                                   c=c, random_movement=True)
 
         if sim_time >= self.free_time_activity_end_time:
             if self.status == StaffStatus.TALKING:
-                principal_room = PrincipalRoomManager()
+                principal_room = self.context.principal_room_manager
                 principal_room.free_seat(self.ped_id)
             self.status = StaffStatus.FREE
 
@@ -628,7 +684,7 @@ class StaffAgent(BaseAgent):
 
         if self.status != StaffStatus.CLEANING_UP:
             if self.status == StaffStatus.TALKING:
-                principal_room = PrincipalRoomManager()
+                principal_room = self.context.principal_room_manager
                 principal_room.free_seat(self.ped_id)
             self.status = StaffStatus.CLEANING_UP
 
@@ -646,8 +702,8 @@ class StudentAgent(BaseAgent):
     https://www.medicalnewstoday.com/articles/how-long-can-you-hold-in-your-pee#capacity
     """
 
-    def __init__(self, ped_id, class_id, targets, bladder_cap=7200):
-        super().__init__(ped_id, targets, bladder_cap, class_id)
+    def __init__(self, ped_id, class_id, targets, bladder_cap=7200, rng=None, context=None):
+        super().__init__(ped_id, targets, bladder_cap, class_id, rng, context)
         self.status = StudentStatus.FREE
 
     def prepare_for_lesson(self, c: Class, sim_time: float):
@@ -661,7 +717,7 @@ class StudentAgent(BaseAgent):
                               nearby=True)
 
     def clean_up_for_lesson(self, c: Class, sim_time: float):
-        self.common_behaviour([x for x in AREA_DICT[self.class_id] if x != -1],
+        self.common_behaviour(FILTERED_AREA[self.class_id],
                               StudentStatus.CLEANING_UP, StudentStatus.CLEANING_UP, sim_time, c=c, random_movement=True,
                               nearby=True)
 
@@ -689,11 +745,11 @@ class StudentAgent(BaseAgent):
             self.update_bladder_full_timing(sim_time)
             c.seat_manager.free_seat(self.ped_id)
         else:
-            self.common_behaviour([x for x in AREA_DICT[self.class_id] if x != -1], StudentStatus.CLEANING_UP,
+            self.common_behaviour(FILTERED_AREA[self.class_id], StudentStatus.CLEANING_UP,
                                   StudentStatus.CLEANING_UP, sim_time, True, c=c, nearby=True)
 
     def prepare_for_nap(self, c: Class, sim_time: float):
-        self.common_behaviour([x for x in AREA_DICT[self.class_id] if x != -1], StudentStatus.PREPARING,
+        self.common_behaviour(FILTERED_AREA[self.class_id], StudentStatus.PREPARING,
                               StudentStatus.PREPARING, sim_time, True, c=c, nearby=True)
 
     def do_nap(self, c: Class, sim_time: float):
@@ -704,7 +760,7 @@ class StudentAgent(BaseAgent):
     def clean_up_for_nap(self, c: Class, sim_time: float):
         if self.status != StudentStatus.CLEANING_UP:
             c.nap_manager.free_seat(self.ped_id)
-        self.common_behaviour([x for x in AREA_DICT[self.class_id] if x != -1], StudentStatus.CLEANING_UP,
+        self.common_behaviour(FILTERED_AREA[self.class_id], StudentStatus.CLEANING_UP,
                               StudentStatus.CLEANING_UP, sim_time, True, c=c, nearby=True)
 
     def prepare_free_choice(self, c: Class, sim_time: float):
@@ -720,14 +776,14 @@ class StudentAgent(BaseAgent):
 
     def do_free_choice(self, c: Class, sim_time: float):
         if self.status == StudentStatus.FREE:
-            random_activity = random.choice([StudentStatus.LEARNING, StudentStatus.OTHERS])
+            random_activity = self.rng.choice([StudentStatus.LEARNING, StudentStatus.OTHERS])
             if random_activity == StudentStatus.LEARNING:
                 self.current_target = c.seat_manager.assign_seat(self.ped_id)
                 self.status = StudentStatus.LEARNING
             elif random_activity == StudentStatus.OTHERS:
-                self.current_target = random.choice([x for x in AREA_DICT[c.class_id] if x != -1])
+                self.current_target = self.rng.choice(FILTERED_AREA[c.class_id])
                 self.status = StudentStatus.OTHERS
-            self.free_time_activity_end_time = sim_time + np.random.normal(300, 20)
+            self.free_time_activity_end_time = sim_time + self.rng.normal(300, 20)
         if sim_time > self.free_time_activity_end_time:
             if self.status == StudentStatus.LEARNING:
                 c.seat_manager.free_seat(self.ped_id)
@@ -737,12 +793,12 @@ class StudentAgent(BaseAgent):
         if self.status != StudentStatus.CLEANING_UP:
             if self.status == StudentStatus.LEARNING:
                 c.seat_manager.free_seat(self.ped_id)
-        self.common_behaviour([x for x in AREA_DICT[self.class_id] if x != -1], StudentStatus.CLEANING_UP,
+        self.common_behaviour(FILTERED_AREA[self.class_id], StudentStatus.CLEANING_UP,
                               StudentStatus.CLEANING_UP, sim_time, True, c=c, nearby=True)
 
     def end(self, c: Class, sim_time: float):
         if not self.set_to_end:
-            self.free_time_activity_end_time = sim_time + np.random.normal(270, 180)
+            self.free_time_activity_end_time = sim_time + self.rng.normal(270, 180)
             self.set_to_end = True
 
         # leave at random timing
@@ -750,41 +806,20 @@ class StudentAgent(BaseAgent):
             self.current_target = EXIT
 
         else:
-            self.common_behaviour([x for x in AREA_DICT[self.class_id] if x != -1], StudentStatus.FREE,
+            self.common_behaviour(FILTERED_AREA[self.class_id], StudentStatus.FREE,
                                   StudentStatus.FREE, sim_time, True, c=c, nearby=True)
 
 
-class Principal(StaffAgent, metaclass=Singleton):
+class Principal(StaffAgent):
     """
-    Principal agent ( only one)
+    Principal agent ( only one per SimulationContext)
     """
-    _initialised = False
-
-    def __init__(self, ped_id=None, class_id=None, targets=None):
-        if not self._initialised:
-            super().__init__(ped_id, class_id, targets)
-            Principal._initialised = True
-            self.status = PrincipalStatus.FREE
-            self.chill_spot = None
-            self.interested_class = None
 
-    def reset(self):
+    def __init__(self, ped_id=None, class_id=None, targets=None, rng=None, context=None):
+        super().__init__(ped_id, class_id, targets, rng=rng, context=context)
         self.status = PrincipalStatus.FREE
         self.chill_spot = None
         self.interested_class = None
-        self.interest_stack = TargetPriorityQueue()
-        self.toilet_state = Constants.ToiletState.NOT_USING
-        self.fidget_time = 0.0
-        self.status = None
-        self.target_end_time = 0.0
-        self.next_toilet_time = np.random.normal(self.bladder_cap, 45)
-        self.free_time_activity_end_time = 0
-        self.set_to_end = False
-        self.toilet_change_target_time = 0
-        self.old_target = None
-        self.current_pos = (0, 0)
-        self.reach_intermediate = False
-        self.intermediate_targets = []
 
     def update_agent_movement(self, c: Class, sim_time: float):
         # Check if the agent needs to go toilet and can only go during doing event phase
@@ -803,42 +838,42 @@ class Principal(StaffAgent, metaclass=Singleton):
 
         # Supervising work here
         if self.status == PrincipalStatus.FREE:
-            random_activity = random.choice(
+            random_activity = self.rng.choice(
                 [PrincipalStatus.IN_OFFICE, PrincipalStatus.SUPERVISING, PrincipalStatus.CHILL])
 
             if random_activity == PrincipalStatus.IN_OFFICE:
                 self.status = PrincipalStatus.IN_OFFICE
                 self.current_target = PRINCIPAL_TABLE
-                self.free_time_activity_end_time = sim_time + np.random.normal(1800, 120)
+                self.free_time_activity_end_time = sim_time + self.rng.normal(1800, 120)
 
             elif random_activity == PrincipalStatus.SUPERVISING:
                 self.interested_class = self.class_id
                 self.status = PrincipalStatus.SUPERVISING
-                self.free_time_activity_end_time = sim_time + np.random.normal(450, 60)
+                self.free_time_activity_end_time = sim_time + self.rng.normal(450, 60)
             elif random_activity == PrincipalStatus.CHILL:
-                self.chill_spot = random.choice([STAFF_HANGOUT_SPOT_BREAK_ROOM, STAFF_HANGOUT_SPOT_KITCHENETTE])
+                self.chill_spot = self.rng.choice([STAFF_HANGOUT_SPOT_BREAK_ROOM, STAFF_HANGOUT_SPOT_KITCHENETTE])
                 self.status = PrincipalStatus.CHILL
-                self.free_time_activity_end_time = sim_time + np.random.normal(900, 90)
+                self.free_time_activity_end_time = sim_time + self.rng.normal(900, 90)
 
         if sim_time >= self.free_time_activity_end_time:
             if self.status == PrincipalStatus.IN_OFFICE:
-                pm = PrincipalRoomManager()
+                pm = self.context.principal_room_manager
                 # if there is somebody in the office
                 if not pm.is_empty():
                     return
             self.status = PrincipalStatus.FREE
         elif self.status == PrincipalStatus.CHILL:
-            self.common_behaviour(AREA_DICT[self.chill_spot], PrincipalStatus.CHILL, PrincipalStatus.CHILL, sim_time,
-                                  c=c, random_movement=True)
+            self.common_behaviour(FILTERED_AREA[self.chill_spot], PrincipalStatus.CHILL, PrincipalStatus.CHILL,
+                                  sim_time, c=c, random_movement=True)
         elif self.status == PrincipalStatus.SUPERVISING:
-            self.common_behaviour([x for x in AREA_DICT[self.interested_class] if x != -1], PrincipalStatus.SUPERVISING,
+            self.common_behaviour(FILTERED_AREA[self.interested_class], PrincipalStatus.SUPERVISING,
                                   PrincipalStatus.SUPERVISING, sim_time,
                                   c=c, random_movement=True)
 
     def update_interested_class(self, cm):
-        classes = [c.class_id for c in cm.classes.values() if c.event_state != EventState.ALL_FINISHED]
+        classes = cm.active_class_ids
         if classes:
-            self.class_id = random.choice(classes)
+            self.class_id = self.rng.choice(classes)
 
     def is_free(self):
         return self.status == PrincipalStatus.FREE
@@ -1,19 +1,34 @@
-import random
-from collections import defaultdict
-from typing import Dict, List, Tuple
+from __future__ import annotations
 
-import numpy as np
+from collections import defaultdict
+from typing import Dict, List, Tuple, TYPE_CHECKING
 
 from Controller import DailyConstants
 from Controller.Agent import StudentAgent, StaffAgent, BaseAgent, Principal
 from Controller.Constants import ToiletState
-from Controller.DailyConstants import ActivityType, EventState, PRINCIPAL_ROOM, StaffStatus, StaffType
+from Controller.DailyConstants import ActivityType, EventState, PRINCIPAL_ROOM, StaffStatus, StaffType, StudentStatus
+from Controller.EventLog import EventLog
+from Controller.Layout import FILTERED_AREA, nearby_targets
+from Controller.RandomSource import RandomStream, AGENT_STREAM, CLASS_STREAM, MANAGER_STREAM, CLASS_MANAGER_STREAM
 from Controller.SeatManager import TableSeatManager, NapSeatManager
-from Controller.Singleton import Singleton
+from Controller.WakeupScheduler import WakeupScheduler
+
+if TYPE_CHECKING:
+    from Controller.SimulationContext import SimulationContext
+
+# free staff rotate between classes every hour
+FREE_STAFF_ROTATION = 3600
+# events whose students only take a seat (meal) or a nap spot once the event is in progress, with the status of a
+# seated student. The transition hook seats the whole class at once instead of waking every student.
+SEATED_EVENTS = {
+    ActivityType.MEAL: StudentStatus.EATING,
+    ActivityType.NAP: StudentStatus.NAPPING,
+}
 
 
 class Class:
-    def __init__(self, class_id, class_name, class_schedule: list, students=None, staffs=None):
+    def __init__(self, class_id, class_name, class_schedule: list, students=None, staffs=None, event_log=None,
+                 rng=None):
         self.class_id: str = class_id
         self.class_name: str = class_name
         self.class_schedule: List[Tuple[ActivityType, int]] = class_schedule
@@ -26,13 +41,24 @@ class Class:
         self.prepare_end_time: float = 0.0
         self.clean_up_end_time: float = 0.0
         self.spread_dict = None
-        self.seat_manager = TableSeatManager(self.class_id)
-        self.nap_manager = NapSeatManager(self.class_id)
+        self.rng: RandomStream = rng if rng is not None else RandomStream()
+        self.seat_manager = TableSeatManager(self.class_id, self.rng)
+        self.nap_manager = NapSeatManager(self.class_id, self.rng)
         self.agents = []
         self.event_index = 0
         self.prepare_time = 0
         self.clean_up_time = 0
         self.free_staff: List[StaffAgent, None] = []
+        self.event_log: EventLog = event_log if event_log is not None else EventLog()
+        # called as hook(c, old_state, new_state, sim_time) on every event state transition
+        self.transition_hooks = []
+
+    def set_event_state(self, event_state: EventState, sim_time: float):
+        old_state = self.event_state
+        self.event_log.record(self.class_name, self.current_event[0], old_state, event_state, sim_time)
+        self.event_state = event_state
+        for hook in self.transition_hooks:
+            hook(self, old_state, event_state, sim_time)
 
     def update_current_event(self, sim_time):
         """
@@ -43,7 +69,7 @@ class Class:
         if self.event_state == EventState.ALL_FINISHED:
             return
         last_event = False
-        PREPARE_DURATION = np.random.normal(120, 30)
+        PREPARE_DURATION = self.rng.normal(120, 30)
 
         if self.event_index < len(self.class_schedule) - 1:
             next_event = self.class_schedule[self.event_index + 1]
@@ -51,45 +77,43 @@ class Class:
             last_event = True
         # for first event
         if self.event_state == EventState.YET_TO_START:
-            self.pare_time = np.random.normal(PREPARE_DURATION, 3)
+            self.pare_time = self.rng.normal(PREPARE_DURATION, 3)
             self.prepare_end_time = sim_time + self.prepare_time
-            self.clean_up_time = np.random.normal(PREPARE_DURATION, 3)
+            self.clean_up_time = self.rng.normal(PREPARE_DURATION, 3)
             self.current_event_end_time = self.prepare_end_time + (
                     self.current_event[1] - self.prepare_time - self.clean_up_time)
             self.clean_up_end_time = self.current_event_end_time + self.clean_up_time
-            self.event_state = EventState.PREPARING
+            self.set_event_state(EventState.PREPARING, sim_time)
 
         # start the next event
         if self.event_state == EventState.FINISHED:
             if not last_event:
-                self.prepare_time = np.random.normal(PREPARE_DURATION, 3)
-                self.clean_up_time = np.random.normal(PREPARE_DURATION, 3)
+                self.prepare_time = self.rng.normal(PREPARE_DURATION, 3)
+                self.clean_up_time = self.rng.normal(PREPARE_DURATION, 3)
                 self.prepare_end_time = sim_time + self.prepare_time
                 self.current_event = next_event
-                self.event_state = EventState.PREPARING
+                self.set_event_state(EventState.PREPARING, sim_time)
                 self.event_index += 1
             else:
-                self.event_state = EventState.ALL_FINISHED
+                self.set_event_state(EventState.ALL_FINISHED, sim_time)
 
         # Preparation stage of the event
         if self.event_state == EventState.PREPARING and self.can_proceed_to_next_event_state():
             if sim_time > self.prepare_end_time:
                 self.current_event_end_time = sim_time + (
                         self.current_event[1] - self.prepare_time - self.clean_up_time)
-                self.event_state = EventState.IN_PROGRESS
+                self.set_event_state(EventState.IN_PROGRESS, sim_time)
 
         # Main event stage
         if self.event_state == EventState.IN_PROGRESS and self.can_proceed_to_next_event_state():
             if sim_time > self.current_event_end_time:
                 self.clean_up_end_time = sim_time + self.clean_up_time
-                self.event_state = EventState.CLEAN_UP
+                self.set_event_state(EventState.CLEAN_UP, sim_time)
 
         # Clean up stage of the event
         if self.event_state == EventState.CLEAN_UP and self.can_proceed_to_next_event_state():
             if sim_time > self.clean_up_end_time:
-                self.event_state = EventState.FINISHED
-
-        print("Event State: " + f'{self.class_name} ' + str(self.event_state) + f' Activity: {self.current_event[0]}')
+                self.set_event_state(EventState.FINISHED, sim_time)
 
     def can_proceed_to_next_event_state(self):
         for agent in self.agents:
@@ -117,28 +141,7 @@ class Class:
         return self.find_nearby_grid(idx, connectivity)
 
     def find_nearby_grid(self, idx, connectivity=8):
-        grid = DailyConstants.AREA_DICT[self.class_id]
-        nums_rows, nums_cols = DailyConstants.GROUP_SIZE[self.class_id]
-        index = DailyConstants.AREA_DICT[self.class_id].index(idx)
-        grid_size = DailyConstants.GROUP_SIZE[self.class_id]
-        i = index // grid_size[1], index % grid_size[1]
-        row, col = i
-        neighbors = []
-
-        # 4-connected neighbors (up, down, left, right)
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-
-        # If 8-connected, include diagonal neighbors
-        if connectivity == 8:
-            directions += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-
-        for dr, dc in directions:
-            new_row, new_col = row + dr, col + dc
-            if 0 <= new_row < nums_rows and 0 <= new_col < nums_cols:
-                index = new_row * nums_cols + new_col
-                neighbors.append(grid[index])
-        neighbors = [neighbor for neighbor in neighbors if neighbor != -1]
-        return neighbors
+        return nearby_targets(self.class_id, idx, connectivity)
 
     def get_evenly_speared_dict(self):
         if self.spread_dict is None:
@@ -157,10 +160,10 @@ def distribute_evenly_around_class_room(c: Class):
     distribution = defaultdict(list)
 
     temp = c.students.copy()
-    random.shuffle(temp)
+    c.rng.shuffle(temp)
 
+    filtered_area = FILTERED_AREA[c.class_id]
     for i, agent in enumerate(temp):
-        filtered_area = [x for x in DailyConstants.AREA_DICT[c.class_id] if x != -1]
         distribution[filtered_area[i % len(filtered_area)]].append(
             agent.ped_id)
     inverse = {}
@@ -170,69 +173,157 @@ def distribute_evenly_around_class_room(c: Class):
     return inverse
 
 
-class ClassManager(metaclass=Singleton):
+class ClassManager:
     """
     Class Manager to handle class events
     """
-    _initialised = False
-
-    def __init__(self):
-        if not self._initialised:
-            self.agents = {}
-            self.classes: Dict[Class, {}] = {}
-            self.initialise_classes()
-            self.initialise_agents()
-            self.free_agents = []
-            self._initialised = True
-
-    def reset(self):
+
+    def __init__(self, context: SimulationContext):
+        self.context = context
+        self.rng = context.random_source.stream(MANAGER_STREAM, CLASS_MANAGER_STREAM)
         self.agents = {}
         self.classes: Dict[Class, {}] = {}
+        self.event_log = EventLog()
+        self.scheduler = WakeupScheduler()
+        self.rank = {}
+        self.due_agents = None
+        # hour of the day the free staff were last rotated in, the first rotation happens in initialise_agents
+        self.rotation_hour = 0
         self.initialise_classes()
         self.initialise_agents()
+        self.free_agents = []
+
+    def reseed(self):
+        """
+        Replace the random streams of the manager, classes and agents by fresh ones from the context's random source
+        :return:
+        """
+        random_source = self.context.random_source
+        self.rng = random_source.stream(MANAGER_STREAM, CLASS_MANAGER_STREAM)
+        for c in self.classes.values():
+            c.rng = random_source.stream(CLASS_STREAM, c.class_id)
+            c.seat_manager.rng = c.rng
+            c.nap_manager.rng = c.rng
+        for ped_id, agent in self.agents.items():
+            agent.rng = random_source.stream(AGENT_STREAM, ped_id)
 
     def initialise_classes(self):
         for c in DailyConstants.class_list:
-            self.classes[c[0]] = Class(c[0], c[1], class_schedule=DailyConstants.SCHEDULE_DICT[c[0]])
+            self.classes[c[0]] = Class(c[0], c[1], class_schedule=DailyConstants.SCHEDULE_DICT[c[0]],
+                                     event_log=self.event_log,
+                                     rng=self.context.random_source.stream(CLASS_STREAM, c[0]))
+            self.classes[c[0]].transition_hooks.append(self.wake_class)
+            self.classes[c[0]].transition_hooks.append(self.update_active_classes)
+        # classes that have not finished their last event, the principal picks one of them to supervise
+        self.active_class_ids = tuple(self.classes)
 
     def initialise_agents(self):
+        random_source = self.context.random_source
         for c in self.classes.keys():
             student_list = []
             staff_list = []
             for student in DailyConstants.STUDENT_DICT[c]:
-                t = StudentAgent(student, c, self.classes[c].class_schedule)
+                t = StudentAgent(student, c, self.classes[c].class_schedule,
+                                 rng=random_source.stream(AGENT_STREAM, student), context=self.context)
                 self.agents[student] = t
                 student_list.append(t)
             for staff in DailyConstants.STAFF_DICT[c]:
-                t = StaffAgent(staff, c, self.classes[c].class_schedule)
+                t = StaffAgent(staff, c, self.classes[c].class_schedule,
+                               rng=random_source.stream(AGENT_STREAM, staff), context=self.context)
                 self.agents[staff] = t
                 staff_list.append(t)
             self.update_class_members(c, student_list, staff_list)
 
         for staff in DailyConstants.STAFF_DICT[DailyConstants.FREE_STAFF_GROUP]:
-            c = random.choice(list(self.classes.keys()))
-            t = StaffAgent(staff, c, None, StaffType.FREE_ROAMING)
+            c = self.rng.choice(list(self.classes.keys()))
+            t = StaffAgent(staff, c, None, StaffType.FREE_ROAMING, rng=random_source.stream(AGENT_STREAM, staff),
+                           context=self.context)
 
             self.agents[staff] = t
+        # agents are always updated in roster order
+        self.rank = {ped_id: i for i, ped_id in enumerate(self.agents)}
+        self.scheduler.wake(self.agents)
         self.rotate_free_staff()
 
     def update_class_members(self, c_id, c, s):
         self.classes[c_id].update_class_members(c, s)
 
+    def collect_due_agents(self, sim_time):
+        """
+        Take the agents that have to be updated at sim_time off the wake-up schedule
+        :param sim_time:
+        :return: due agents in roster order
+        """
+        due = self.scheduler.pop_due(sim_time)
+        due.sort(key=self.rank.__getitem__)
+        self.due_agents = [self.agents[ped_id] for ped_id in due]
+        return self.due_agents
+
     def update_class_movement(self, sim_time):
+        """
+        Update the agents that are due and reschedule them: every step while something is going on, otherwise at
+        their next timer. A class changing its event state wakes up all of its members.
+        :param sim_time:
+        :return:
+        """
         c: Class
         agent: BaseAgent
+        if self.due_agents is None:
+            self.collect_due_agents(sim_time)
+        scheduler = self.scheduler
+        for agent in self.due_agents:
+            signature = agent.wakeup_signature()
+            agent.update_agent_movement(self.classes[agent.class_id], sim_time)
+            if agent.wakeup_signature() != signature:
+                scheduler.schedule(agent.ped_id, sim_time)
+            else:
+                scheduler.schedule(agent.ped_id, agent.next_wakeup_time(sim_time))
+        self.due_agents = None
+
         for c in self.classes.values():
-            for agent in c.agents:
-                agent.update_agent_movement(c, sim_time)
-            for staff in c.free_staff:
-                staff.update_agent_movement(c, sim_time)
             c.update_current_event(sim_time)
 
+    def wake_class(self, c: Class, old_state: EventState, new_state: EventState, sim_time: float):
+        seated = self.seat_class(c, new_state, sim_time)
+        self.scheduler.wake([agent.ped_id for agent in c.agents if agent.ped_id not in seated])
+        self.scheduler.wake([staff.ped_id for staff in c.free_staff])
+
+    def seat_class(self, c: Class, new_state: EventState, sim_time: float):
+        """
+        When a meal or a nap gets in progress, assign the seats or nap spots of the whole class in one pass and move
+        the students there. This replaces the update each student would get on the next step, the seated students are
+        scheduled at their next timer instead of being woken. Students in the toilet flow or due for it are left to
+        their own update.
+        :param c:
+        :param new_state:
+        :param sim_time:
+        :return: ped ids of the seated students
+        """
+        activity = c.current_event[0]
+        if new_state != EventState.IN_PROGRESS or activity not in SEATED_EVENTS:
+            return set()
+        seat_manager = c.seat_manager if activity == ActivityType.MEAL else c.nap_manager
+        students = [student for student in c.students
+                    if student.toilet_state == ToiletState.NOT_USING and not student.need_go_toilet(sim_time)]
+        seat_manager.assign_seats([student.ped_id for student in students
+                                   if student.status != SEATED_EVENTS[activity]])
+        for student in students:
+            # what update_agent_movement does for them, do_event finds the seat already assigned
+            student.random_movement = False
+            student.do_event(c, sim_time)
+            self.scheduler.schedule(student.ped_id, student.next_wakeup_time(sim_time))
+        return {student.ped_id for student in students}
+
+    def update_active_classes(self, c: Class, old_state: EventState, new_state: EventState, sim_time: float):
+        if new_state == EventState.ALL_FINISHED:
+            self.active_class_ids = tuple(class_id for class_id in self.active_class_ids if class_id != c.class_id)
+
     def update_free_staff(self, sim_time):
-        # Only swap every 1 hour (3600 seconds)
-        if sim_time % 3600 != 0:
+        # Only swap every 1 hour (3600 seconds), on the first call in a new hour as the calls need not land on it
+        hour = int(sim_time // FREE_STAFF_ROTATION)
+        if hour == self.rotation_hour:
             return
+        self.rotation_hour = hour
         self.rotate_free_staff()
 
     def rotate_free_staff(self):
@@ -244,7 +335,7 @@ class ClassManager(metaclass=Singleton):
             c.free_staff.clear()
 
         free_staff_ids = DailyConstants.STAFF_DICT[DailyConstants.FREE_STAFF_GROUP].copy()
-        random.shuffle(free_staff_ids)
+        self.rng.shuffle(free_staff_ids)
         for idx, staff_id in enumerate(free_staff_ids):
             staff = self.agents[staff_id]
 
@@ -256,3 +347,4 @@ class ClassManager(metaclass=Singleton):
             staff._rotation_index = (staff._rotation_index + 1) % len(class_ids)
             assigned_class_id = class_ids[staff._rotation_index]
             self.classes[assigned_class_id].add_free_staff(staff)
+        self.scheduler.wake(free_staff_ids)
@@ -1,10 +1,7 @@
-import json
 import math
-from datetime import datetime, timedelta
 from enum import Enum
 from pathlib import Path
-from tabulate import tabulate
-from ProjectConstants import PROJECT_PATH
+from Controller.ScenarioGeometry import load_geometry
 
 class ActivityType(Enum):
     LARGE_GROUP = 0
@@ -83,11 +80,9 @@ INTERMEDIATE_TOILET_TARGET_POS = (0, 0)
 INTERMEDIATE_TOILET_TARGET_2_POS = (0, 0)
 
 
-json_path = f"{PROJECT_PATH}/target_center_daily_with_table.json"
-with open(json_path) as f:
-    target_dict = json.load(f)
-    INTERMEDIATE_TOILET_TARGET_POS = target_dict[str(INTERMEDIATE_TOILET_TARGET)]
-    INTERMEDIATE_TOILET_TARGET_2_POS = target_dict[str(INTERMEDIATE_TOILET_TARGET_2)]
+GEOMETRY = load_geometry()
+INTERMEDIATE_TOILET_TARGET_POS = GEOMETRY.centre(INTERMEDIATE_TOILET_TARGET)
+INTERMEDIATE_TOILET_TARGET_2_POS = GEOMETRY.centre(INTERMEDIATE_TOILET_TARGET_2)
 
 STUDENT_DICT = {
     CLASSROOM_3: [x for x in range(180, 200)],
@@ -215,6 +210,10 @@ def get_targets_from_table():
 
 
 def get_schematic_schedule_for_each_classroom():
+    # report only, keep these out of the simulation's import time
+    from datetime import datetime, timedelta
+    from tabulate import tabulate
+
     # Start time
     start_time = datetime.strptime("08:30", "%H:%M")
 
@@ -0,0 +1,37 @@
+import json
+
+
+class EventLog:
+    """
+    In-memory log of class event state transitions, written out in bulk as JSON lines at the end of a run
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.entries = []
+
+    def record(self, class_name, activity, old_state, new_state, sim_time):
+        """
+        Record a transition of a class from old_state to new_state
+        :param class_name:
+        :param activity: ActivityType of the current event
+        :param old_state: EventState
+        :param new_state: EventState
+        :param sim_time:
+        :return:
+        """
+        self.entries.append((sim_time, class_name, activity.name, old_state.name, new_state.name))
+        if self.verbose:
+            print(f"{sim_time:.1f} Event State: {class_name} {old_state} -> {new_state} Activity: {activity}")
+
+    def dump(self, path):
+        """
+        Write all recorded transitions to path, one JSON object per line
+        :param path:
+        :return:
+        """
+        with open(path, "w") as f:
+            f.writelines(
+                json.dumps({"sim_time": sim_time, "class": class_name, "activity": activity, "old_state": old_state,
+                            "new_state": new_state}) + "\n"
+                for sim_time, class_name, activity, old_state, new_state in self.entries)
@@ -0,0 +1,58 @@
+"""
+Immutable index of the daily scenario layout, built once at import from DailyConstants.
+
+Agents look areas and neighbours up here instead of filtering AREA_DICT and walking the grid on every call.
+"""
+from typing import Dict, FrozenSet, Tuple
+
+from Controller.DailyConstants import AREA_DICT, GROUP_SIZE
+
+# grid directions in the order Class.find_nearby_grid has always listed the neighbours
+DIRECTIONS = {
+    4: ((-1, 0), (1, 0), (0, -1), (0, 1)),
+    8: ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)),
+}
+
+# targets of every area without the -1 placeholders of the grid layout
+FILTERED_AREA: Dict[int, Tuple[int, ...]] = {
+    area_id: tuple(x for x in targets if x != -1) for area_id, targets in AREA_DICT.items()
+}
+AREA_MEMBERS: Dict[int, FrozenSet[int]] = {area_id: frozenset(targets) for area_id, targets in FILTERED_AREA.items()}
+
+
+class Adjacency:
+    """
+    Neighbours of every target of the grid laid out areas (GROUP_SIZE), keyed by (area id, target)
+    """
+
+    def __init__(self, connectivity):
+        self.connectivity = connectivity
+        self.neighbours: Dict[Tuple[int, int], Tuple[int, ...]] = {}
+        for area_id, (num_rows, num_cols) in GROUP_SIZE.items():
+            grid = AREA_DICT[area_id]
+            for index, target in enumerate(grid):
+                # a target listed twice in an area uses its first cell like list.index
+                if target == -1 or (area_id, target) in self.neighbours:
+                    continue
+                row, col = index // num_cols, index % num_cols
+                neighbours = []
+                for dr, dc in DIRECTIONS[connectivity]:
+                    new_row, new_col = row + dr, col + dc
+                    if 0 <= new_row < num_rows and 0 <= new_col < num_cols:
+                        neighbour = grid[new_row * num_cols + new_col]
+                        if neighbour != -1:
+                            neighbours.append(neighbour)
+                self.neighbours[area_id, target] = tuple(neighbours)
+
+
+ADJACENCY = {connectivity: Adjacency(connectivity) for connectivity in DIRECTIONS}
+
+
+def nearby_targets(area_id, target, connectivity=8):
+    """
+    :param area_id: area laid out as a grid
+    :param target: target of that area
+    :param connectivity: 4 or 8
+    :return: targets of the cells around target
+    """
+    return ADJACENCY[connectivity].neighbours[area_id, target]
@@ -0,0 +1,55 @@
+from itertools import chain
+
+import numpy as np
+
+
+class PositionBuffer:
+    """
+    Positions of all pedestrians in one (n, 2) array, refreshed with a single bulk copy per step.
+
+    Bound agents hold a view of their row as current_pos, so they always see the latest position without being
+    touched on every step and the whole array is available for vectorised distance checks.
+    """
+
+    def __init__(self):
+        self.ped_ids = np.zeros(0, dtype=np.int64)
+        self.positions = np.zeros((0, 2))
+        # dense ped id -> row lookup, -1 for ids without a row
+        self.rows = np.full(0, -1, dtype=np.int64)
+
+    def bind(self, agents):
+        """
+        Give every agent a row and replace its current_pos by a view of that row, keeping its last position
+        :param agents: agents with ped_id and current_pos
+        :return:
+        """
+        self.ped_ids = np.array([agent.ped_id for agent in agents], dtype=np.int64)
+        self.positions = np.array([agent.current_pos for agent in agents], dtype=np.float64).reshape(-1, 2)
+        self.rows = np.full(self.ped_ids.max(initial=-1) + 1, -1, dtype=np.int64)
+        self.rows[self.ped_ids] = np.arange(len(self.ped_ids))
+        for row, agent in enumerate(agents):
+            agent.current_pos = self.positions[row]
+
+    def lookup_rows(self, ped_ids):
+        """
+        :param ped_ids: ids as int or str
+        :return: row of every id, -1 for ids without a row
+        """
+        ped_ids = np.asarray(ped_ids, dtype=np.int64)
+        rows = np.full(len(ped_ids), -1, dtype=np.int64)
+        known = (ped_ids >= 0) & (ped_ids < len(self.rows))
+        rows[known] = self.rows[ped_ids[known]]
+        return rows
+
+    def update(self, positions):
+        """
+        Copy the positions reported by Vadere into the buffer
+        :param positions: [[ped_id, x, y], ...] as returned by get_position2_dlist
+        :return:
+        """
+        if not positions:
+            return
+        table = np.fromiter(chain.from_iterable(positions), np.float64, 3 * len(positions)).reshape(-1, 3)
+        rows = self.lookup_rows(table[:, 0])
+        known = rows >= 0
+        self.positions[rows[known]] = table[known, 1:]
@@ -0,0 +1,66 @@
+import numpy as np
+
+BLOCK_SIZE = 256
+
+# first element of the spawn key, keeps the streams of agents, classes and managers apart
+AGENT_STREAM = 0
+CLASS_STREAM = 1
+MANAGER_STREAM = 2
+
+# keys of the manager streams
+CLASS_MANAGER_STREAM = 0
+PRINCIPAL_ROOM_STREAM = 1
+TOILET_STREAM = 2
+
+
+class RandomStream:
+    """
+    Scalar random draws served from blocks pre-sampled with a NumPy Generator.
+
+    Provides the subset of the random module / numpy.random API used by the agents (normal, random, choice,
+    shuffle) without paying NumPy's per-call overhead on every draw.
+    """
+
+    def __init__(self, seed_sequence=None, block_size=BLOCK_SIZE):
+        self.generator = np.random.Generator(np.random.PCG64(seed_sequence))
+        self.block_size = block_size
+        self.normals = []
+        self.uniforms = []
+
+    def normal(self, loc=0.0, scale=1.0):
+        if not self.normals:
+            self.normals = self.generator.standard_normal(self.block_size).tolist()
+        return loc + scale * self.normals.pop()
+
+    def random(self):
+        if not self.uniforms:
+            self.uniforms = self.generator.random(self.block_size).tolist()
+        return self.uniforms.pop()
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def shuffle(self, seq):
+        for i in range(len(seq) - 1, 0, -1):
+            j = int(self.random() * (i + 1))
+            seq[i], seq[j] = seq[j], seq[i]
+
+
+class RandomSource:
+    """
+    Source of independent random streams for one run, all derived from the run seed.
+
+    A stream only depends on the run seed and its key, so results do not change with the order agents are created.
+    """
+
+    def __init__(self, seed=None):
+        # keep the entropy so that a run started without a seed can be reproduced
+        self.seed = np.random.SeedSequence(seed).entropy
+
+    def stream(self, kind, key=0):
+        """
+        :param kind: AGENT_STREAM, CLASS_STREAM or MANAGER_STREAM
+        :param key: ped id, class id or manager number
+        :return: RandomStream
+        """
+        return RandomStream(np.random.SeedSequence(self.seed, spawn_key=(kind, key)))
@@ -0,0 +1,142 @@
+"""
+Target and obstacle geometry of the Vadere scenario, compiled once into a .npz artifact.
+
+The artifact is keyed by a hash of the scenario file, so editing the scenario produces a new artifact on the next
+load_geometry call while unchanged scenarios are loaded straight from the cache.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from ProjectConstants import PROJECT_PATH
+
+SCENARIO_FILE = PROJECT_PATH / "vadere" / "scenarios" / "daily_table_edited.json"
+CACHE_DIR = PROJECT_PATH / ".cache" / "scenario_geometry"
+# bump when the layout of the artifact changes so that old artifacts are rebuilt
+FORMAT_VERSION = 1
+
+_loaded = {}
+
+
+class ScenarioGeometry:
+    """
+    Rectangles of the targets and obstacles of a scenario as (x, y, width, height) rows, plus the target centres
+    rounded to 2 decimals and a dense target id -> row lookup.
+    """
+
+    def __init__(self, target_ids, target_rects, obstacle_ids, obstacle_rects):
+        self.target_ids = np.asarray(target_ids, dtype=np.int64)
+        self.target_rects = np.asarray(target_rects, dtype=np.float64).reshape(-1, 4)
+        self.obstacle_ids = np.asarray(obstacle_ids, dtype=np.int64)
+        self.obstacle_rects = np.asarray(obstacle_rects, dtype=np.float64).reshape(-1, 4)
+        self.target_centres = np.round(self.target_rects[:, :2] + self.target_rects[:, 2:] / 2, 2)
+        # row of every target id, -1 for ids that are not targets
+        self.target_index = np.full(self.target_ids.max(initial=-1) + 1, -1, dtype=np.int64)
+        self.target_index[self.target_ids] = np.arange(len(self.target_ids))
+
+    def centre(self, target_id):
+        """
+        :param target_id:
+        :return: (x, y) centre of the target
+        """
+        row = self.target_index[int(target_id)]
+        if row < 0:
+            raise KeyError(target_id)
+        return tuple(self.target_centres[row].tolist())
+
+    def centres_of(self, target_ids, default=(0.0, 0.0)):
+        """
+        :param target_ids: ids as ints or strings
+        :param default: centre used for ids that are not targets
+        :return: (n, 2) array of centres
+        """
+        target_ids = np.asarray(target_ids, dtype=np.int64)
+        rows = np.full(len(target_ids), -1, dtype=np.int64)
+        known = (target_ids >= 0) & (target_ids < len(self.target_index))
+        rows[known] = self.target_index[target_ids[known]]
+        centres = np.empty((len(target_ids), 2))
+        centres[:] = default
+        centres[rows >= 0] = self.target_centres[rows[rows >= 0]]
+        return centres
+
+    def target_centres_dict(self):
+        """
+        :return: {target id: (x, y)}
+        """
+        return dict(zip(self.target_ids.tolist(), map(tuple, self.target_centres.tolist())))
+
+    def save(self, path):
+        np.savez(path, target_ids=self.target_ids, target_rects=self.target_rects, obstacle_ids=self.obstacle_ids,
+                 obstacle_rects=self.obstacle_rects)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["target_ids"], data["target_rects"], data["obstacle_ids"], data["obstacle_rects"])
+
+
+def rectangles(elements):
+    """
+    :param elements: targets or obstacles of a Vadere topography, all with RECTANGLE shapes
+    :return: ids, (x, y, width, height) rows
+    """
+    ids = [element["id"] for element in elements]
+    rects = [(element["shape"]["x"], element["shape"]["y"], element["shape"]["width"], element["shape"]["height"])
+             for element in elements]
+    return ids, rects
+
+
+def compile_scenario(path=SCENARIO_FILE):
+    """
+    Parse a Vadere scenario file (or a bare topography as exported from the editor)
+    :param path:
+    :return: ScenarioGeometry
+    """
+    with open(path) as f:
+        topography = json.load(f)
+    if "scenario" in topography:
+        topography = topography["scenario"]["topography"]
+    target_ids, target_rects = rectangles(topography["targets"])
+    obstacle_ids, obstacle_rects = rectangles(topography["obstacles"])
+    return ScenarioGeometry(target_ids, target_rects, obstacle_ids, obstacle_rects)
+
+
+def scenario_hash(path):
+    digest = hashlib.sha256(f"v{FORMAT_VERSION}".encode())
+    with open(path, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def load_geometry(path=SCENARIO_FILE, cache_dir=CACHE_DIR):
+    """
+    Load the compiled geometry of a scenario, compiling it first if the scenario changed since the last build
+    :param path: scenario file
+    :param cache_dir: directory holding the compiled artifacts
+    :return: ScenarioGeometry
+    """
+    path = Path(path)
+    key = f"{path.stem}-{scenario_hash(path)}"
+    if key in _loaded:
+        return _loaded[key]
+
+    artifact = Path(cache_dir) / f"{key}.npz"
+    if artifact.exists():
+        geometry = ScenarioGeometry.load(artifact)
+    else:
+        geometry = compile_scenario(path)
+        artifact.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so that concurrent runs never see a partial artifact
+        fd, tmp = tempfile.mkstemp(suffix=".npz", dir=artifact.parent)
+        with os.fdopen(fd, "wb") as f:
+            geometry.save(f)
+        os.replace(tmp, artifact)
+        for stale in artifact.parent.glob(f"{path.stem}-*.npz"):
+            if stale != artifact:
+                stale.unlink(missing_ok=True)
+    _loaded[key] = geometry
+    return geometry
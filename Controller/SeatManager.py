@@ -1,44 +1,81 @@
-import random
-
 from Controller.DailyConstants import CHAIR_DICT, NAP_POSITION_DICT
-from Controller.Singleton import Singleton
+from Controller.RandomSource import RandomStream
 
 
 class TableSeatManager:
     """
     Tracks seating
+
+    Free seats are kept in a free list, assign_seat picks a random entry and swap-removes it and free_seat appends
+    the seat again, so neither depends on the number of seats.
     """
 
-    def __init__(self, class_id):
-        self.seats = {}
+    def __init__(self, class_id, rng=None):
+        self.seats = ()
+        self.free = []
         self.assigned_seats = {}
         self.class_id = class_id
+        # anything with a random() method, a fresh unseeded RandomStream by default
+        self.rng = rng if rng is not None else RandomStream()
         self.initialize_seats()
 
+    def layout(self):
+        """
+        :return: seats of the class in layout order
+        """
+        return CHAIR_DICT[self.class_id]
+
     def initialize_seats(self):
-        self.seats = dict.fromkeys(CHAIR_DICT[self.class_id], None)
+        self.seats = tuple(dict.fromkeys(self.layout()))
+        self.free = list(self.seats)
+        self.assigned_seats = {}
 
     def assign_seat(self, ped_id):
 
-        if ped_id in self.assigned_seats.keys():
+        if ped_id in self.assigned_seats:
             return self.assigned_seats[ped_id]
 
-        if len(self.assigned_seats) < len(self.seats):
-            available_seats = [key for key, value in self.seats.items() if value is None]
-            random_seat = random.choice(available_seats)
+        if self.free:
+            random_seat = self.take(int(self.rng.random() * len(self.free)))
             self.assigned_seats[ped_id] = random_seat
-            self.seats[random_seat] = True
             return random_seat
         else:
             raise KeyError("Should have enough seats!!!", ped_id, self.class_id)
 
+    def assign_seats(self, ped_ids):
+        """
+        Assign seats to a group of agents in one pass, in order. Agents that already have a seat keep it, the others
+        draw their seats exactly as one assign_seat call each would.
+        :param ped_ids:
+        :return: seat of every agent
+        """
+        assigned_seats = self.assigned_seats
+        new = [ped_id for ped_id in dict.fromkeys(ped_ids) if ped_id not in assigned_seats]
+        if len(new) > len(self.free):
+            raise KeyError("Should have enough seats!!!", new[len(self.free)], self.class_id)
+        rng = self.rng
+        for ped_id in new:
+            assigned_seats[ped_id] = self.take(int(rng.random() * len(self.free)))
+        return [assigned_seats[ped_id] for ped_id in ped_ids]
+
+    def take(self, position):
+        """
+        Swap-remove the seat at position of the free list
+        :param position:
+        :return: the seat
+        """
+        seat = self.free[position]
+        last = self.free.pop()
+        if position < len(self.free):
+            self.free[position] = last
+        return seat
+
     def free_seat(self, ped_id):
-        assigned_seat = self.assigned_seats[ped_id]
-        self.assigned_seats.pop(ped_id)
-        self.seats[assigned_seat] = None
+        assigned_seat = self.assigned_seats.pop(ped_id)
+        self.free.append(assigned_seat)
 
     def is_seat_available(self):
-        return len(self.assigned_seats) < len(self.seats)
+        return bool(self.free)
 
 
 class NapSeatManager(TableSeatManager):
@@ -46,26 +83,14 @@ class NapSeatManager(TableSeatManager):
     Same as Tables but different set of targets
     """
 
-    def __init__(self, class_id):
-        super().__init__(class_id)
-        self.initialize_seats()
+    def layout(self):
+        return NAP_POSITION_DICT[self.class_id]
 
-    def initialize_seats(self):
-        self.seats = dict.fromkeys(NAP_POSITION_DICT[self.class_id], None)
 
+class PrincipalRoomManager(TableSeatManager):
+    """
+    Seats in the principal's office
+    """
 
-class PrincipalRoomManager(TableSeatManager, metaclass=Singleton):
-    _initialised = False
-
-    def __init__(self, class_id=None):
-        if not self._initialised:
-            super().__init__(class_id)
-            self.initialize_seats()
-            PrincipalRoomManager._initialised = True
-
-    def reset(self):
-        self.seats = {}
-        self.assigned_seats = {}
-        self.initialize_seats()
     def is_empty(self):
         return len(self.assigned_seats.keys()) == 0
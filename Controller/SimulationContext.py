@@ -0,0 +1,44 @@
+from Controller.Agent import Principal
+from Controller.ClassManager import ClassManager
+from Controller.DailyConstants import PRINCIPAL_ROOM, CLASSROOM_6
+from Controller.RandomSource import RandomSource, AGENT_STREAM, MANAGER_STREAM, PRINCIPAL_ROOM_STREAM, TOILET_STREAM
+from Controller.SeatManager import PrincipalRoomManager
+from Controller.ToiletEventManager import ToiletEventManager
+
+PRINCIPAL_ID = 2
+
+
+class SimulationContext:
+    """
+    State of one simulation run: the class manager with its classes and agents, the principal, the principal room
+    and the toilet manager, all drawing from one random source.
+
+    Agents reach the shared managers through the context they were created with, so several contexts can live in
+    the same process without interfering.
+    """
+
+    def __init__(self, seed=None, verbose=False):
+        """
+        :param seed: run seed all random streams are derived from
+        :param verbose: print every class event transition to the console while running
+        """
+        self.random_source = RandomSource(seed)
+        self.principal_room_manager = PrincipalRoomManager(
+            PRINCIPAL_ROOM, rng=self.random_source.stream(MANAGER_STREAM, PRINCIPAL_ROOM_STREAM))
+        self.principal = Principal(PRINCIPAL_ID, CLASSROOM_6, [],
+                                   rng=self.random_source.stream(AGENT_STREAM, PRINCIPAL_ID), context=self)
+        self.class_manager = ClassManager(self)
+        self.class_manager.event_log.verbose = verbose
+        self.toilet_manager = ToiletEventManager(rng=self.random_source.stream(MANAGER_STREAM, TOILET_STREAM))
+
+    def reseed(self, seed):
+        """
+        Replace every random stream of the run by a fresh one derived from seed
+        :param seed: run seed
+        :return:
+        """
+        self.random_source = RandomSource(seed)
+        self.principal_room_manager.rng = self.random_source.stream(MANAGER_STREAM, PRINCIPAL_ROOM_STREAM)
+        self.principal.rng = self.random_source.stream(AGENT_STREAM, PRINCIPAL_ID)
+        self.toilet_manager.rng = self.random_source.stream(MANAGER_STREAM, TOILET_STREAM)
+        self.class_manager.reseed()
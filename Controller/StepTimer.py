@@ -0,0 +1,80 @@
+import csv
+import json
+from array import array
+from time import perf_counter
+
+import numpy as np
+
+# time spent between two controller calls, i.e. Vadere computing the next steps plus the TraCI round-trip
+OUTSIDE_CONTROLLER = "outside_controller"
+PERCENTILES = (50, 95, 99)
+
+
+class StepTimer:
+    """
+    Accumulates the wall-clock duration of each named phase of a controller step.
+
+    Call start() when the step begins, lap(phase) after each phase and stop() at the end of the step.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.last = None
+        self.step_end = None
+
+    def reset(self):
+        self.samples = {}
+        self.last = None
+        self.step_end = None
+
+    def start(self):
+        now = perf_counter()
+        if self.step_end is not None:
+            self.add(OUTSIDE_CONTROLLER, now - self.step_end)
+        self.last = now
+
+    def lap(self, phase):
+        now = perf_counter()
+        self.add(phase, now - self.last)
+        self.last = now
+
+    def stop(self):
+        self.step_end = self.last
+
+    def add(self, phase, duration):
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples[phase] = array("d")
+        samples.append(duration)
+
+    def summary(self):
+        """
+        Per phase statistics in seconds
+        :return: {phase: {count, total, mean, p50, p95, p99, max}}
+        """
+        summary = {}
+        for phase, samples in self.samples.items():
+            values = np.frombuffer(samples, dtype=np.float64)
+            stats = {"count": len(values), "total": float(values.sum()), "mean": float(values.mean())}
+            for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                stats[f"p{p}"] = float(value)
+            stats["max"] = float(values.max())
+            summary[phase] = stats
+        return summary
+
+    def dump(self, path):
+        """
+        Write the summary to path.csv and path.json
+        :param path: output path without extension
+        :return:
+        """
+        summary = self.summary()
+        with open(f"{path}.json", "w") as f:
+            json.dump(summary, f, indent=4)
+
+        fields = ["phase", "count", "total", "mean"] + [f"p{p}" for p in PERCENTILES] + ["max"]
+        with open(f"{path}.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, delimiter=";")
+            writer.writeheader()
+            for phase, stats in summary.items():
+                writer.writerow({"phase": phase, **stats})
@@ -1,41 +1,61 @@
-import queue
-import random
+from bisect import insort
+from collections import deque
 
 import Controller.Constants as Constants
 from Controller.Agent import BaseAgent
 from Controller.DailyConstants import CLASSROOM_5, CLASSROOM_6
+from Controller.RandomSource import RandomStream
 
 
 class ToiletEventManager:
-    def __init__(self):
-        self.sinks = dict.fromkeys(Constants.SINK, None)
-        self.cubicles = dict.fromkeys(Constants.CUBICLES, None)
+    """
+    Queue, cubicles and sinks of the toilet.
+
+    The queue keeps a ticket per agent so that its position is found without scanning, free cubicles and sinks are
+    kept in free lists in the order of Constants.CUBICLES / Constants.SINK and active holds the agents currently in
+    the toilet flow, which are the only ones handle_active has to visit.
+    """
+
+    def __init__(self, rng=None):
+        # anything with choice(seq) and random() methods, a fresh unseeded RandomStream by default
+        self.rng = rng if rng is not None else RandomStream()
+        self.toilet_queue = Constants.DENSITY_AREA_DICT[Constants.TOILET_ENTRANCE].copy()
+        self.assigned_queue = deque()
+        # ped id -> ticket, the position in the queue is the ticket minus the number of agents served
+        self.tickets = {}
+        self.next_ticket = 0
+        self.served = 0
+        self.free_cubicles = list(Constants.CUBICLES)
+        self.free_sinks = list(Constants.SINK)
+        self.cubicle_rank = {cubicle: rank for rank, cubicle in enumerate(Constants.CUBICLES)}
+        self.sink_rank = {sink: rank for rank, sink in enumerate(Constants.SINK)}
         self.assigned_sinks = {}
         self.assigned_cubicles = {}
-        self.assigned_queue = queue.Queue(maxsize=len(Constants.DENSITY_AREA_DICT[Constants.TOILET_ENTRANCE]))
-        self.toilet_queue = Constants.DENSITY_AREA_DICT[Constants.TOILET_ENTRANCE].copy()
-        self.sink_waiting_area_density = []
+        # ped ids waiting for a sink in arrival order, used as an ordered set
+        self.sink_waiting_area_density = {}
+        # ped id -> agent for every agent that entered the toilet flow and has not left it yet
+        self.active = {}
 
     def is_cubicle_free(self):
         """
         Check if there is any empty cubicle
         :return:
         """
-        return len(self.assigned_cubicles) < len(self.cubicles)
+        return bool(self.free_cubicles)
 
     def is_sink_free(self):
         """
         Check if there is any empty sink
         :return:
         """
-        return len(self.assigned_sinks) < len(self.sinks)
+        return bool(self.free_sinks)
 
     def is_queue_free(self):
         """
         Check if there is available queue
         :return:
         """
-        return self.assigned_queue.qsize() < len(self.toilet_queue)
+        return len(self.assigned_queue) < len(self.toilet_queue)
 
     def free_up_cubicle(self, ped_id):
         """
@@ -43,18 +63,14 @@ class ToiletEventManager:
         :param ped_id:
         :return:
         """
-        assigned_cubicle = self.assigned_cubicles[ped_id]
-        self.assigned_cubicles.pop(ped_id)
-        self.cubicles[assigned_cubicle] = None
+        insort(self.free_cubicles, self.assigned_cubicles.pop(ped_id), key=self.cubicle_rank.__getitem__)
 
     def free_up_sink(self, ped_id):
         """
         Free up the sink when the agent is done washing their hands and stuff
         :return:
         """
-        assigned_sink = self.assigned_sinks[ped_id]
-        self.assigned_sinks.pop(ped_id)
-        self.sinks[assigned_sink] = None
+        insort(self.free_sinks, self.assigned_sinks.pop(ped_id), key=self.sink_rank.__getitem__)
 
     def free_up_queue(self):
         """
@@ -62,7 +78,8 @@ class ToiletEventManager:
         :param ped_id:
         :return:
         """
-        self.assigned_queue.get()
+        del self.tickets[self.assigned_queue.popleft()]
+        self.served += 1
 
     def assign_queue(self, ped_id):
         """
@@ -70,11 +87,11 @@ class ToiletEventManager:
         :param ped_id:
         :return:
         """
-        if ped_id in self.assigned_queue.queue:
-            return self.toilet_queue[list(self.assigned_queue.queue).index(ped_id)]
-
-        self.assigned_queue.put(ped_id)
-        return self.toilet_queue[list(self.assigned_queue.queue).index(ped_id)]
+        if ped_id not in self.tickets:
+            self.assigned_queue.append(ped_id)
+            self.tickets[ped_id] = self.next_ticket
+            self.next_ticket += 1
+        return self.toilet_queue[self.tickets[ped_id] - self.served]
 
     def assign_cubicle(self, ped_id):
         """
@@ -83,13 +100,11 @@ class ToiletEventManager:
         :return:
         """
 
-        if ped_id in self.assigned_cubicles.keys():
+        if ped_id in self.assigned_cubicles:
             return self.assigned_cubicles[ped_id]
 
-        available_cubicles = [key for key, value in self.cubicles.items() if value is None]
-        random_cubicle = random.choice(available_cubicles)
+        random_cubicle = self.take_random(self.free_cubicles)
         self.assigned_cubicles[ped_id] = random_cubicle
-        self.cubicles[random_cubicle] = True
         return random_cubicle
 
     def assign_sink(self, ped_id):
@@ -99,15 +114,23 @@ class ToiletEventManager:
         :return:
         """
 
-        if ped_id in self.assigned_sinks.keys():
+        if ped_id in self.assigned_sinks:
             return self.assigned_sinks[ped_id]
 
-        available_sinks = [key for key, value in self.sinks.items() if value is None]
-        random_sink = random.choice(available_sinks)
+        random_sink = self.take_random(self.free_sinks)
         self.assigned_sinks[ped_id] = random_sink
-        self.sinks[random_sink] = True
         return random_sink
 
+    def take_random(self, free):
+        """
+        Take a random resource off a free list
+        :param free: free cubicles or sinks
+        :return:
+        """
+        chosen = self.rng.choice(free)
+        free.remove(chosen)
+        return chosen
+
     def toilet_event_handling(self, agent: BaseAgent, sim_time):
         """
         Refer to toilet event diagram for the full event flow.
@@ -126,7 +149,7 @@ class ToiletEventManager:
                 agent.set_next_target(sim_time)
                 agent.set_intermediate_target(agent.current_target)
             else:
-                if random.random() <= 0.4 and agent.toilet_state == Constants.ToiletState.WANT_TO_GO_TOILET:
+                if agent.rng.random() <= 0.4 and agent.toilet_state == Constants.ToiletState.WANT_TO_GO_TOILET:
                     agent.set_next_target(sim_time)
                     agent.change_toilet_state(Constants.ToiletState.WAITING_FOR_QUEUE)
                     agent.add_target((agent.current_target, 20), 1)
@@ -134,7 +157,7 @@ class ToiletEventManager:
         if agent.toilet_state == Constants.ToiletState.IN_QUEUE:
             # if there is any free cubicle and is at the top of the queue
             # to validate if this function is thread safe
-            if self.is_cubicle_free() and self.assigned_queue.queue[0] == agent.ped_id:
+            if self.is_cubicle_free() and self.assigned_queue[0] == agent.ped_id:
                 self.free_up_queue()
                 cubicle_number = self.assign_cubicle(agent.ped_id)
                 agent.add_target((cubicle_number, 10), 0)
@@ -155,15 +178,13 @@ class ToiletEventManager:
             if self.is_sink_free():
                 sink_number = self.assign_sink(agent.ped_id)
                 agent.add_target((sink_number, 10), 0)
-                if agent.ped_id in self.sink_waiting_area_density:
-                    self.sink_waiting_area_density.remove(agent.ped_id)
+                self.sink_waiting_area_density.pop(agent.ped_id, None)
                 agent.change_toilet_state(Constants.ToiletState.IN_SINK)
                 agent.set_next_target(sim_time)
             else:
                 agent.add_target((Constants.SINK_WAITING_AREA, 10), 0)
                 agent.change_toilet_state(Constants.ToiletState.WAITING_FOR_SINK)
-                if agent.ped_id not in self.sink_waiting_area_density:
-                    self.sink_waiting_area_density.append(agent.ped_id)
+                self.sink_waiting_area_density[agent.ped_id] = None
                 agent.set_next_target(sim_time)
         # handling after sink
         if agent.toilet_state == Constants.ToiletState.IN_SINK and agent.is_fulfilled(sim_time):
@@ -175,3 +196,25 @@ class ToiletEventManager:
                 agent.change_toilet_state(Constants.ToiletState.NOT_USING)
             agent.set_next_target(sim_time)
             agent.set_intermediate_target(agent.current_target, reverse=True)
+
+    def join(self, agent: BaseAgent):
+        """
+        Add an agent that entered the toilet flow to the active roster
+        :param agent:
+        :return:
+        """
+        self.active[agent.ped_id] = agent
+
+    def handle_active(self, sim_time, rank):
+        """
+        Run toilet_event_handling for every agent on the active roster and drop the agents that left the flow
+        :param sim_time:
+        :param rank: ped id -> roster position, agents are handled in this order
+        :return: True if any agent is still in the toilet flow
+        """
+        for ped_id in sorted(self.active, key=rank.__getitem__):
+            agent = self.active[ped_id]
+            self.toilet_event_handling(agent, sim_time)
+            if agent.toilet_state in (Constants.ToiletState.NOT_USING, Constants.ToiletState.JUST_ENDED):
+                del self.active[ped_id]
+        return bool(self.active)
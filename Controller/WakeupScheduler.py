@@ -0,0 +1,90 @@
+import heapq
+import math
+
+
+class WakeupScheduler:
+    """
+    Min-heap of agent wake-up times.
+
+    Each agent has at most one live due time, older heap entries of a rescheduled agent are skipped lazily when
+    they reach the top of the heap. Agents in the background (e.g. pedestrians that left the simulation) are still
+    woken up but kept in a heap of their own, next_due_time does not see them.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.background = set()
+        self.background_heap = []
+        self.due_times = {}
+        self.counter = 0
+
+    def heap_of(self, ped_id):
+        return self.background_heap if ped_id in self.background else self.heap
+
+    def schedule(self, ped_id, due_time):
+        """
+        Set the next wake-up time of an agent, replacing the previous one
+        :param ped_id:
+        :param due_time: simulation time, math.inf to only wake up on wake()
+        :return:
+        """
+        if self.due_times.get(ped_id) == due_time:
+            return
+        self.due_times[ped_id] = due_time
+        if due_time != math.inf:
+            heapq.heappush(self.heap_of(ped_id), (due_time, self.counter, ped_id))
+            self.counter += 1
+
+    def set_background(self, ped_ids):
+        """
+        Replace the set of background agents, their pending wake-ups move to the other heap
+        :param ped_ids:
+        :return:
+        """
+        moved = self.background.symmetric_difference(ped_ids)
+        self.background = set(ped_ids)
+        for ped_id in moved:
+            due_time = self.due_times.get(ped_id)
+            # the entry left in the old heap is skipped as it no longer matches the agent's heap
+            if due_time is not None and due_time != math.inf:
+                heapq.heappush(self.heap_of(ped_id), (due_time, self.counter, ped_id))
+                self.counter += 1
+
+    def wake(self, ped_ids):
+        """
+        Make the agents due on the next call of pop_due
+        :param ped_ids:
+        :return:
+        """
+        for ped_id in ped_ids:
+            self.schedule(ped_id, -math.inf)
+
+    def next_due_time(self):
+        """
+        :return: earliest live wake-up time of an agent not in the background, math.inf if none is waiting for one
+        """
+        heap = self.heap
+        due_times = self.due_times
+        background = self.background
+        # drop the outdated entries of rescheduled agents from the top, pop_due would skip them anyway
+        while heap and (due_times.get(heap[0][2]) != heap[0][0] or heap[0][2] in background):
+            heapq.heappop(heap)
+        return heap[0][0] if heap else math.inf
+
+    def pop_due(self, sim_time):
+        """
+        Remove and return the agents whose wake-up time is at or before sim_time
+        :param sim_time:
+        :return: list of ped ids
+        """
+        due_times = self.due_times
+        background = self.background
+        due = []
+        for heap, in_background in ((self.heap, False), (self.background_heap, True)):
+            while heap and heap[0][0] <= sim_time:
+                due_time, _, ped_id = heapq.heappop(heap)
+                if due_times.get(ped_id) != due_time or (ped_id in background) != in_background:
+                    continue
+                del due_times[ped_id]
+                due.append(ped_id)
+        return due
@@ -8,6 +8,7 @@ from Controller import Constants, DailyConstants
 from Controller.Constants import TOILET_ENTRANCE, DENSITY_AREA_DICT, SUBGROUP_R, SUBGROUP_B, SUBGROUP_T, CHAIRS, \
     TABLE
 from Controller.DailyConstants import TABLE_DICT
+from Controller.ScenarioGeometry import compile_scenario
 
 
 
@@ -75,14 +76,14 @@ def split_into_random_groups(agents, min_size=5, max_size=5):
 
 
 def create_target_center_dictionary(filename, output_filename):
-    target_list = {}
-    with open(filename) as f:
-        d = json.load(f)
-        t = d["targets"]
-        for target in t:
-            target_list[target["id"]] = (round(target["shape"]["x"] + target["shape"]["width"] / 2, 2),
-                                         round(target["shape"]["y"] + target["shape"]["height"] / 2, 2))
-        print(target_list)
+    """
+    Export the target centres of a scenario as json, the simulation itself reads them from ScenarioGeometry
+    :param filename: scenario file
+    :param output_filename:
+    :return:
+    """
+    target_list = compile_scenario(filename).target_centres_dict()
+    print(target_list)
 
     with open(output_filename, "w") as f:
         json.dump(target_list, f, indent=4)
@@ -1,8 +1,12 @@
-import json
-from Controller.Agent import Principal
-from Controller.ClassManager import ClassManager
-from Controller.DailyConstants import PRINCIPAL_ROOM, CLASSROOM_6
-from Controller.SeatManager import TableSeatManager, PrincipalRoomManager
+import math
+import pickle
+
+from Controller.ClassManager import FREE_STAFF_ROTATION
+from Controller.Constants import ToiletState
+from Controller.DailyConstants import EventState
+from Controller.PositionBuffer import PositionBuffer
+from Controller.SimulationContext import SimulationContext
+from Controller.StepTimer import StepTimer
 
 from flowcontrol.crownetcontrol.setup.entrypoints import get_controller_from_args
 from flowcontrol.crownetcontrol.state.state_listener import VadereDefaultStateListener
@@ -10,14 +14,51 @@ from flowcontrol.crownetcontrol.controller import Controller
 from flowcontrol.crownetcontrol.traci import constants_vadere as tc
 from flowcontrol.strategy.timestepping.timestepping import FixedTimeStepper
 
-from ProjectConstants import PROJECT_PATH
+
+class AdaptiveTimeStepper(FixedTimeStepper):
+    """
+    Fixed time stepper that stretches the interval between controller calls while nothing is happening.
+
+    The interval stays a multiple of the base step size, doubles on every quiet call up to max_time_step_size, never
+    reaches past the horizon reported by the controller and falls back to the base step as soon as the controller
+    reports activity.
+    """
+
+    def __init__(self, time_step_size=0.4, start_time=0.4, max_time_step_size=4.0):
+        super().__init__(time_step_size=time_step_size, start_time=start_time)
+        self.base_time_step_size = time_step_size
+        self.max_time_step_size = max_time_step_size
+        self.horizon = 0.0
+
+    def set_horizon(self, horizon):
+        """
+        :param horizon: seconds until the next known change, 0 if the controller has to run on the next step
+        :return:
+        """
+        self.horizon = horizon
+
+    def forward_time(self):
+        base = self.base_time_step_size
+        step = min(self.time_step_size * 2, self.max_time_step_size, self.horizon)
+        self.time_step_size = max(base, base * math.floor(step / base + 1e-9))
+        super().forward_time()
+
+
 class Base(Controller):
     """
     Base class for PCF simulation
     """
 
-    def __init__(self):
-        super().__init__(time_stepper=FixedTimeStepper(time_step_size=0.4, start_time=0.4))
+    def __init__(self, max_time_step_size=None):
+        """
+        :param max_time_step_size: longest interval between controller calls, None to call on every 0.4s step
+        """
+        if max_time_step_size:
+            time_stepper = AdaptiveTimeStepper(time_step_size=0.4, start_time=0.4,
+                                               max_time_step_size=max_time_step_size)
+        else:
+            time_stepper = FixedTimeStepper(time_step_size=0.4, start_time=0.4)
+        super().__init__(time_stepper=time_stepper)
 
 
     def handle_sim_step(self, sim_time, sim_state):
@@ -31,46 +72,224 @@ class Base(Controller):
 
 
 class Daily(Base, Controller):
-    def __init__(self):
-        self.classManager = ClassManager()
-        self.principal = Principal(2, CLASSROOM_6, [])
-        self.principalRoomManager = PrincipalRoomManager(PRINCIPAL_ROOM)
-        super().__init__()
-        with open(f"{PROJECT_PATH}/target_center_daily_with_table.json") as f:
-            self.target_dict = json.load(f).keys()
+    def __init__(self, verbose=False, max_time_step_size=None, seed=None):
+        """
+        :param verbose: print every class event transition to the console while running
+        :param max_time_step_size: stretch the controller interval up to this many seconds during quiet periods
+        :param seed: run seed all random streams are derived from, a run with the same seed is reproduced exactly
+        """
+        self.seed = seed
+        self.verbose = verbose
+        self.context = SimulationContext(seed, verbose)
+        self.positions = PositionBuffer()
+        self.bind_positions()
+        super().__init__(max_time_step_size)
+        # last target sent to Vadere for each pedestrian
+        self.sent_targets = {}
+        self.step_timer = StepTimer()
+        # path (without extension) the phase timings are written to when the controller stops
+        self.timing_output = None
+        # path the class event transitions are written to when the controller stops
+        self.event_log_output = None
+        # save a checkpoint to checkpoint_output once the simulation reaches checkpoint_at
+        self.checkpoint_at = None
+        self.checkpoint_output = None
+        # simulation time of the checkpoint this run was restored from, added to Vadere's clock
+        self.sim_time_offset = 0.0
+        # set by load_checkpoint, the restored positions are sent to Vadere on the next step
+        self.positions_restored = False
+        # pedestrian ids Vadere reported on the last step
+        self.present_ids = None
+
+    @property
+    def classManager(self):
+        return self.context.class_manager
+
+    @property
+    def principal(self):
+        return self.context.principal
+
+    @property
+    def principalRoomManager(self):
+        return self.context.principal_room_manager
+
+    @property
+    def toiletManager(self):
+        return self.context.toilet_manager
 
     def reset(self):
-        self.classManager.reset()
-        self.principal.reset()
-        self.principalRoomManager.reset()
+        """
+        Start the day over with a fresh simulation context, the managers and agents are rebuilt rather than reset
+        :return:
+        """
+        self.context = SimulationContext(self.seed, self.verbose)
+        self.bind_positions()
+        self.sent_targets = {}
+        self.step_timer.reset()
+        self.sim_time_offset = 0.0
+        self.positions_restored = False
+        self.present_ids = None
+
+    def start_controller(self):
+        try:
+            super().start_controller()
+        finally:
+            if self.timing_output:
+                self.step_timer.dump(self.timing_output)
+            if self.event_log_output:
+                self.classManager.event_log.dump(self.event_log_output)
+
+    def save_checkpoint(self, path, sim_time):
+        """
+        Pickle the complete controller state, i.e. the simulation context: class manager (classes, agents, seat and
+        nap managers, schedule), principal, principal room and toilet manager, including their random streams.
+        :param path:
+        :param sim_time: simulation time the state belongs to
+        :return:
+        """
+        state = {
+            "sim_time": sim_time,
+            "context": self.context,
+        }
+        with open(path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_checkpoint(self, path, seed=None):
+        """
+        Restore a checkpoint written by save_checkpoint, replacing the simulation context. Call it after reset(),
+        which would discard the restored context. The run continues at the checkpoint time, Vadere's clock is offset
+        accordingly and every pedestrian is moved to its checkpointed position on the next step. Edit the restored
+        classes (e.g. class_schedule) afterwards to branch a what-if from the checkpoint.
+        :param path:
+        :param seed: reseed the random streams so that branches from the same checkpoint diverge
+        :return: simulation time of the checkpoint
+        """
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+
+        self.context = state["context"]
+        if seed is not None:
+            self.seed = seed
+            self.context.reseed(seed)
+
+        self.bind_positions()
+        # Vadere starts without our targets and positions, send all of them again
+        self.sent_targets = {}
+        self.present_ids = None
+        self.positions_restored = True
+        self.sim_time_offset = state["sim_time"]
+        return state["sim_time"]
 
     def handle_sim_step(self, sim_time, sim_state):
+        sim_time += self.sim_time_offset
+        timer = self.step_timer
+        timer.start()
+        if self.positions_restored:
+            self.send_positions()
+            self.positions_restored = False
         aa = list(self.con_manager.domains.v_person.get_id_list())
         self.update_position(aa)
+        timer.lap("update_position")
         self.principal.update_interested_class(self.classManager)
         self.principal.update_agent_movement(None, sim_time)
-        for agent in self.classManager.agents.values():
-            self.toiletManager.toilet_event_handling(agent, sim_time)
+        timer.lap("principal")
+        # agents that left the simulation keep being updated but no longer hold up the adaptive time stepper, they can
+        # stay in their last toilet state for good
+        present = set(aa)
+        if present != self.present_ids:
+            self.present_ids = present
+            self.classManager.scheduler.set_background(
+                [ped_id for ped_id in self.classManager.agents if str(ped_id) not in present])
+        # agents in the toilet flow are due on every step, new ones join the toilet manager's roster
+        toilet_busy = self.principal.toilet_state != ToiletState.NOT_USING
+        for agent in self.classManager.collect_due_agents(sim_time):
+            if agent.toilet_state != ToiletState.NOT_USING:
+                self.toiletManager.join(agent)
+                toilet_busy = toilet_busy or str(agent.ped_id) in present
+        self.toiletManager.handle_active(sim_time, self.classManager.rank)
 
         self.toiletManager.toilet_event_handling(self.principal, sim_time)
+        timer.lap("toilet")
         self.classManager.update_free_staff(sim_time)
+        timer.lap("free_staff")
         self.classManager.update_class_movement(sim_time)
+        timer.lap("class_movement")
+        self.push_targets(aa)
+        timer.lap("push_targets")
+        timer.stop()
+
+        if self.checkpoint_at is not None and sim_time >= self.checkpoint_at:
+            self.save_checkpoint(self.checkpoint_output, sim_time)
+            self.checkpoint_at = None
+
+        if isinstance(self.time_stepper, AdaptiveTimeStepper):
+            self.time_stepper.set_horizon(0.0 if toilet_busy else self.quiet_horizon(sim_time))
+        self.time_stepper.forward_time()
+
+    def quiet_horizon(self, sim_time):
+        """
+        How long the controller can stay away without skipping over a class event transition, a free staff
+        rotation or an agent timer (bladder, fidget, end of an activity). Agents that left the simulation are not
+        waited for. Only quiet while every class that is not done yet is in the middle of its main event.
+        :param sim_time:
+        :return: seconds, 0 if the controller has to run on the next step
+        """
+        horizon = min(FREE_STAFF_ROTATION - sim_time % FREE_STAFF_ROTATION,
+                      self.classManager.scheduler.next_due_time() - sim_time,
+                      self.principal.next_wakeup_time(sim_time) - sim_time)
+        for c in self.classManager.classes.values():
+            if c.event_state == EventState.ALL_FINISHED:
+                continue
+            if c.event_state != EventState.IN_PROGRESS:
+                return 0.0
+            horizon = min(horizon, c.current_event_end_time - sim_time)
+        return max(horizon, 0.0)
+
+    def push_targets(self, aa):
+        """
+        Send the current target of every pedestrian whose target changed since the last push.
+        Unchanged pedestrians are skipped so a step only costs as many round-trips as there are changes.
+        :param aa: pedestrian ids currently in the simulation
+        :return:
+        """
+        changed = {}
         for ped_id in aa:
             if ped_id == "2":
-                self.con_manager.domains.v_person.set_target_list(str(ped_id), [str(self.principal.current_target)])
+                target = self.principal.current_target
             else:
+                target = self.classManager.agents[int(ped_id)].current_target
+            if self.sent_targets.get(ped_id) != target:
+                changed[ped_id] = target
 
-                self.con_manager.domains.v_person.set_target_list(str(ped_id), [
-                    str(self.classManager.agents[int(ped_id)].current_target)])
+        if changed:
+            self.send_targets(changed)
+            self.sent_targets.update(changed)
 
-        self.time_stepper.forward_time()
+    def send_targets(self, changed):
+        """
+        Flush one step worth of target changes to Vadere
+        :param changed: {ped_id: target}
+        :return:
+        """
+        v_person = self.con_manager.domains.v_person
+        for ped_id, target in changed.items():
+            v_person.set_target_list(str(ped_id), [str(target)])
 
-    def update_position(self, aa):
+    def send_positions(self):
+        """
+        Move every pedestrian in Vadere to its position in the position buffer, used to continue from a checkpoint
+        :return:
+        """
+        v_person = self.con_manager.domains.v_person
+        for ped_id, (x, y) in zip(self.positions.ped_ids.tolist(), self.positions.positions.tolist()):
+            v_person.set_position(str(ped_id), x, y)
 
-        pos = list(self.con_manager.domains.v_person.get_position2_dlist())
+    def update_position(self, aa):
+        self.positions.update(list(self.con_manager.domains.v_person.get_position2_dlist()))
 
-        for ped in pos:
-            if str(ped[0]) == "2":
-                self.principal.update_position(ped[1:3])
-            else:
-                self.classManager.agents[ped[0]].update_position(ped[1:3])
+    def bind_positions(self):
+        """
+        Point the current_pos of every agent and the principal at their row of the position buffer
+        :return:
+        """
+        self.positions.bind([*self.classManager.agents.values(), self.principal])
@@ -0,0 +1,120 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from Controller.DailyConstants import EXIT
+from Controller.ScenarioGeometry import load_geometry
+
+WALKING_SPEED = 1.34
+
+
+class HeadlessPersonDomain:
+    """
+    Stand-in for the Vadere person domain (con_manager.domains.v_person).
+
+    Only the calls used by Daily are provided. Every pedestrian walks in a straight line towards the centre of
+    its current target at a constant speed and stops there, pedestrians reaching an absorbing target are removed.
+    """
+
+    def __init__(self, target_centres, speed=WALKING_SPEED, absorbing_targets=(EXIT,)):
+        self.target_centres = {int(k): v for k, v in target_centres.items()}
+        self.speed = speed
+        self.absorbing_targets = set(absorbing_targets)
+        self.ped_ids = []
+        self.rows = {}
+        self.positions = np.zeros((0, 2))
+        self.destinations = np.zeros((0, 2))
+        self.targets = np.zeros(0, dtype=int)
+        self.active = np.zeros(0, dtype=bool)
+
+    def add_pedestrian(self, ped_id, target, position=None):
+        """
+        Spawn a pedestrian, by default standing on the centre of its target
+        :param ped_id:
+        :param target:
+        :param position: (x, y) to spawn at instead
+        :return:
+        """
+        centre = self.target_centres.get(int(target), (0.0, 0.0))
+        if position is None:
+            position = centre
+        self.rows[int(ped_id)] = len(self.ped_ids)
+        self.ped_ids.append(int(ped_id))
+        self.positions = np.vstack([self.positions, position])
+        self.destinations = np.vstack([self.destinations, centre])
+        self.targets = np.append(self.targets, int(target))
+        self.active = np.append(self.active, True)
+
+    def get_id_list(self):
+        return [str(ped_id) for ped_id, active in zip(self.ped_ids, self.active) if active]
+
+    def get_position2_dlist(self):
+        return [[ped_id, x, y] for ped_id, (x, y), active in zip(self.ped_ids, self.positions.tolist(), self.active)
+                if active]
+
+    def set_position(self, element_id, x, y):
+        row = self.rows[int(element_id)]
+        self.positions[row] = (x, y)
+
+    def set_target_list(self, element_id, targets):
+        row = self.rows[int(element_id)]
+        target = int(targets[0])
+        self.targets[row] = target
+        # targets missing from the scenario leave the pedestrian standing where it is
+        self.destinations[row] = self.target_centres.get(target, self.positions[row])
+
+    def advance(self, time_step_size):
+        """
+        Move every active pedestrian towards its destination for one time step
+        :param time_step_size:
+        :return:
+        """
+        delta = self.destinations - self.positions
+        distance = np.linalg.norm(delta, axis=1)
+        moving = self.active & (distance > 0)
+        ratio = np.minimum(1.0, self.speed * time_step_size / np.where(moving, distance, 1.0))
+        self.positions[moving] += delta[moving] * ratio[moving, None]
+
+        arrived = moving & (ratio >= 1.0)
+        if self.absorbing_targets and np.any(arrived):
+            absorbed = arrived & np.isin(self.targets, list(self.absorbing_targets))
+            self.active[absorbed] = False
+
+
+def run_headless(controller, end_time=36000, time_step_size=0.4, speed=WALKING_SPEED):
+    """
+    Run a Daily controller against the headless person domain instead of a Vadere server
+    :param controller: Daily
+    :param end_time: last simulation time to step to
+    :param time_step_size:
+    :param speed: walking speed in m/s
+    :return: the person domain holding the final positions
+    """
+    domain = HeadlessPersonDomain(load_geometry().target_centres_dict(), speed)
+
+    # a controller restored from a checkpoint moves everyone to their checkpointed positions on its first step
+    domain.add_pedestrian(2, controller.principal.current_target)
+    for ped_id, agent in controller.classManager.agents.items():
+        domain.add_pedestrian(ped_id, agent.current_target)
+    controller.con_manager = SimpleNamespace(domains=SimpleNamespace(v_person=domain))
+
+    step = 1
+    sim_time = time_step_size
+    while sim_time <= end_time and np.any(domain.active):
+        controller.handle_sim_step(sim_time, None)
+        # an adaptive time stepper may ask for the next call several steps later
+        interval = getattr(controller.time_stepper, "time_step_size", time_step_size)
+        for _ in range(max(1, round(interval / time_step_size))):
+            domain.advance(time_step_size)
+            step += 1
+        sim_time = round(step * time_step_size, 6)
+    return domain
+
+
+if __name__ == "__main__":
+    from base import Daily
+
+    start = time.time()
+    run_headless(Daily())
+    print("Duration of headless simulation is", time.time() - start)
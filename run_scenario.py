@@ -1,6 +1,9 @@
+import asyncio
 import os
-import pickle
+import socket
+import subprocess
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 from ProjectConstants import VADERE_PATH, OUTPUT_PATH
@@ -13,42 +16,327 @@ from flowcontrol.crownetcontrol.traci import constants_vadere as tc
 from base import Daily
 
 BASE_DIR = Path(__file__).resolve().parent
+# written into a replication's output directory once its controller finished
+COMPLETE_MARKER = "replication.done"
+# Vadere writes its output files when the simulation ends, older output directories without the marker count as
+# complete when this file is there
+POSITION_OUTPUT = os.path.join("_sim", "vadere.d", "OffsetPosition.txt")
+# attempts to start a Vadere server, each on a newly allocated port
+SERVER_START_ATTEMPTS = 5
+
+
+class VadereServerExited(RuntimeError):
+    """
+    The Vadere server exited before it accepted connections, usually because its port was taken in the meantime
+    """
+
+
+def get_settings(i, port=9999):
+    return [
+        "--port",
+        str(port),
+        "--host-name",
+        "localhost",
+        "--scenario-file",
+        f"{VADERE_PATH}/scenarios/daily_with_table.scenario",
+        "--client-mode",
+        "--controller-type",
+        "Daily",
+        "--output-dir",
+        f"{OUTPUT_PATH}/{i}",
+        "-vr",
+        VADERE_PATH,
+        "-j",
+        "vadere-server.jar"
+    ]
+
+
+def is_replication_complete(i):
+    """
+    :param i: replication index
+    :return: True if the controller of replication i finished, or for output directories written before the
+        marker existed, if Vadere wrote the position output
+    """
+    return (os.path.exists(f"{OUTPUT_PATH}/{i}/{COMPLETE_MARKER}")
+            or os.path.exists(f"{OUTPUT_PATH}/{i}/{POSITION_OUTPUT}"))
+
+
+def build_controller(i, port=9999, checkpoint=None):
+    """
+    Connect a Daily controller for replication i to the Vadere server listening on port
+    :param i: replication index, outputs go to OUTPUT_PATH/i
+    :param port:
+    :param checkpoint: continue from this checkpoint of Daily.save_checkpoint instead of the start of the day, the
+        random streams are reseeded with i so that replications branching from the same checkpoint diverge
+    :return: the controller, ready to start
+    """
+    settings = get_settings(i, port)
+    sub = VadereDefaultStateListener.with_vars(
+        "persons",
+        {"pos": tc.VAR_POSITION, "speed": tc.VAR_SPEED, "angle": tc.VAR_ANGLE},
+        init_sub=True,
+    )
+    s = Daily(seed=i)
+    s.timing_output = f"{OUTPUT_PATH}/{i}/step_timing"
+    s.event_log_output = f"{OUTPUT_PATH}/{i}/event_log.jsonl"
+    controller = get_controller_from_args(working_dir=os.getcwd(), args=settings, controller=s)
+    controller.register_state_listener("default", sub, set_default=True)
+    controller.reset()
+    if checkpoint is not None:
+        # after reset, which builds a fresh simulation context
+        s.load_checkpoint(checkpoint, seed=i)
+    return controller
+
+
+def run_controller(i, controller, start_time):
+    """
+    Run the day of a controller from build_controller and mark replication i as complete
+    :param i: replication index
+    :param controller:
+    :param start_time: time.time() when the replication was set up
+    :return:
+    """
+    controller.start_controller()
+    end_time = time.time() - start_time
+    os.makedirs(f"{OUTPUT_PATH}/{i}", exist_ok=True)
+    with open(f"{OUTPUT_PATH}/{i}/{COMPLETE_MARKER}", "w") as f:
+        f.write(f"{end_time}\n")
+    print(
+        "----------------------------------------------------------------------------------------------------------------------------")
+    print("Duration of simulation is", end_time)
+    print(
+        "----------------------------------------------------------------------------------------------------------------------------")
+
+
+def run_replication(i, port=9999, checkpoint=None):
+    """
+    Run a single replication against the Vadere server listening on port
+    :param i: replication index, outputs go to OUTPUT_PATH/i
+    :param port:
+    :param checkpoint: see build_controller
+    :return:
+    """
+    start_time = time.time()
+    run_controller(i, build_controller(i, port, checkpoint), start_time)
+
+
 def run_experiment(start=0, end=30):
     for i in range(start, end):
-        settings = [
-            "--port",
-            "9999",
-            "--host-name",
-            "localhost",
-            "--scenario-file",
-            f"{VADERE_PATH}/scenarios/daily_with_table.scenario",
-            "--client-mode",
-            "--controller-type",
-            "Daily",
-            "--output-dir",
-            f"{OUTPUT_PATH}/{i}",
-            "-vr",
-            VADERE_PATH,
-            "-j",
-            "vadere-server.jar"
-        ]
-        sub = VadereDefaultStateListener.with_vars(
-            "persons",
-            {"pos": tc.VAR_POSITION, "speed": tc.VAR_SPEED, "angle": tc.VAR_ANGLE},
-            init_sub=True,
-        )
-        s = Daily()
-        start_end = time.time()
-        controller = get_controller_from_args(working_dir=os.getcwd(), args=settings, controller=s)
-        controller.register_state_listener("default", sub, set_default=True)
-        controller.reset()
-        controller.start_controller()
-        end_time = time.time() - start_end
-        print(
-            "----------------------------------------------------------------------------------------------------------------------------")
-        print("Duration of simulation is", end_time)
-        print(
-            "----------------------------------------------------------------------------------------------------------------------------")
+        run_replication(i)
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def start_vadere_server(port, timeout=120):
+    """
+    Start a vadere-server.jar on port and wait until it accepts connections
+    :param port:
+    :param timeout: seconds to wait for the server to come up
+    :return: the server process
+    """
+    server = subprocess.Popen(
+        ["java", "-jar", os.path.join(VADERE_PATH, "vadere-server.jar"), "--port", str(port), "--single-client"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise VadereServerExited(f"Vadere server on port {port} exited with code {server.returncode}")
+        try:
+            with socket.create_connection(("localhost", port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.5)
+    server.kill()
+    raise TimeoutError(f"Vadere server on port {port} did not start within {timeout} seconds")
+
+
+def start_vadere_server_on_free_port(attempts=SERVER_START_ATTEMPTS, timeout=120):
+    """
+    Start a Vadere server on a free port. The port is only reserved until find_free_port returns, another server
+    started in parallel can take it first, so a server that exits early is started again on a new port.
+    :param attempts:
+    :param timeout: seconds to wait for each server to come up
+    :return: (server process, port)
+    """
+    for attempt in range(attempts):
+        port = find_free_port()
+        try:
+            return start_vadere_server(port, timeout), port
+        except VadereServerExited:
+            if attempt == attempts - 1:
+                raise
+
+
+def run_replication_with_server(i, checkpoint=None):
+    """
+    Start a dedicated Vadere server on a free port and run replication i against it
+    :param i:
+    :param checkpoint: see run_replication
+    :return: i
+    """
+    server, port = start_vadere_server_on_free_port()
+    try:
+        run_replication(i, port, checkpoint)
+    finally:
+        server.terminate()
+        server.wait()
+    return i
+
+
+def run_experiment_parallel(start=0, end=30, workers=None, checkpoint=None):
+    """
+    Run replications start..end-1 concurrently, each worker drives its own Vadere server.
+    Replications that already finished are skipped so an interrupted batch can simply be restarted.
+    :param start:
+    :param end:
+    :param workers: number of concurrent replications, defaults to the number of cores
+    :param checkpoint: branch every replication from this checkpoint, see run_replication
+    :return:
+    """
+    pending = [i for i in range(start, end) if not is_replication_complete(i)]
+    if not pending:
+        return
+    workers = workers or os.cpu_count()
+    # one replication per worker process, see run_experiment_multiplexed to share one process between many
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending)), max_tasks_per_child=1) as pool:
+        futures = {pool.submit(run_replication_with_server, i, checkpoint): i for i in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Replication {futures[future]} failed: {e!r}")
+
+
+async def wait_for_vadere_server(server, port, timeout=120):
+    """
+    Wait until the Vadere server started on port accepts connections without blocking the event loop
+    :param server: the server process
+    :param port:
+    :param timeout: seconds to wait for the server to come up
+    :return:
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.returncode is not None:
+            raise VadereServerExited(f"Vadere server on port {port} exited with code {server.returncode}")
+        try:
+            _, writer = await asyncio.open_connection("localhost", port)
+        except OSError:
+            await asyncio.sleep(0.5)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+    server.kill()
+    raise TimeoutError(f"Vadere server on port {port} did not start within {timeout} seconds")
+
+
+async def start_vadere_server_async(attempts=SERVER_START_ATTEMPTS, timeout=120):
+    """
+    start_vadere_server_on_free_port without blocking the event loop
+    :param attempts:
+    :param timeout: seconds to wait for each server to come up
+    :return: (server process, port)
+    """
+    for attempt in range(attempts):
+        port = find_free_port()
+        server = await asyncio.create_subprocess_exec(
+            "java", "-jar", os.path.join(VADERE_PATH, "vadere-server.jar"), "--port", str(port), "--single-client",
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            await wait_for_vadere_server(server, port, timeout)
+            return server, port
+        except VadereServerExited:
+            if attempt == attempts - 1:
+                raise
+        except BaseException:
+            if server.returncode is None:
+                server.kill()
+            await server.wait()
+            raise
+
+
+async def run_replication_async(i, executor, connections):
+    """
+    Start a dedicated Vadere server for replication i and run its controller in a thread of executor.
+    The controller is built on the event loop's thread, so flowcontrol's setup never runs off the main thread, and
+    only its day runs in the pool. The controller is not cooperative, it blocks its thread for the whole day. It
+    spends most of that time waiting on TraCI while Vadere computes a step, which releases the GIL, so the threads
+    of the other replications run their step logic in the meantime. The Python side of the steps is still bound by
+    the GIL: the step logic of all controllers of a process runs on one core, add processes to use more. The event
+    loop only starts and waits for the servers.
+    :param i:
+    :param executor: thread pool the controllers run in
+    :param connections: semaphore bounding the number of servers running at once
+    :return: i
+    """
+    async with connections:
+        server, port = await start_vadere_server_async()
+        try:
+            start_time = time.time()
+            controller = build_controller(i, port)
+            await asyncio.get_running_loop().run_in_executor(executor, run_controller, i, controller, start_time)
+        finally:
+            if server.returncode is None:
+                server.terminate()
+            await server.wait()
+    return i
+
+
+async def run_experiment_async(replications, connections=8):
+    """
+    Run replications from the current process, keeping up to connections Vadere servers busy at once. Each
+    simulation runs in its own thread, see run_replication_async.
+    :param replications: replication indices
+    :param connections: number of simulations driven concurrently, and threads in the pool
+    :return: replications that failed
+    """
+    failed = []
+    limit = asyncio.Semaphore(connections)
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        tasks = {asyncio.ensure_future(run_replication_async(i, executor, limit)): i for i in replications}
+        for task, i in tasks.items():
+            try:
+                await task
+            except Exception as e:
+                print(f"Replication {i} failed: {e!r}")
+                failed.append(i)
+    return failed
+
+
+def run_replications_multiplexed(replications, connections=8):
+    """
+    Blocking entry point of run_experiment_async for worker processes
+    :return: replications that failed
+    """
+    return asyncio.run(run_experiment_async(replications, connections))
+
+
+def run_experiment_multiplexed(start=0, end=30, connections=8, processes=1):
+    """
+    Run replications start..end-1 with many Vadere connections per Python process instead of one process each,
+    one thread per connection. The step logic of the controllers in one process shares the GIL, see
+    run_replication_async.
+    Replications that already finished are skipped so an interrupted batch can simply be restarted.
+    :param start:
+    :param end:
+    :param connections: concurrent simulations per process
+    :param processes: number of processes, each takes an interleaved share of the replications
+    :return: replications that failed
+    """
+    pending = [i for i in range(start, end) if not is_replication_complete(i)]
+    if not pending:
+        return []
+    if processes <= 1:
+        return run_replications_multiplexed(pending, connections)
+    shares = [pending[k::processes] for k in range(processes) if pending[k::processes]]
+    with ProcessPoolExecutor(max_workers=len(shares)) as pool:
+        futures = [pool.submit(run_replications_multiplexed, share, connections) for share in shares]
+        return [i for future in as_completed(futures) for i in future.result()]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+"""
+Import time of the entry points, each measured in a fresh interpreter so that every run pays the full cost a pool
+worker pays. Exits with status 1 when an entry point is over its budget.
+
+    python startup_benchmark.py [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# entry point -> import time budget in seconds
+BUDGETS = {
+    "run_scenario": 0.5,
+    "run_analysis": 0.3,
+    "headless": 0.3,
+}
+
+MEASURE = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def import_time(module):
+    """
+    :param module: entry point module name
+    :return: seconds it takes a fresh interpreter to import module
+    """
+    env = os.environ.copy()
+    # run_analysis imports its siblings from the Analysis directory
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(BASE_DIR), str(BASE_DIR / "Analysis"), *filter(None, [env.get("PYTHONPATH")])])
+    result = subprocess.run([sys.executable, "-c", MEASURE.format(module=module)], env=env, cwd=BASE_DIR,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per entry point")
+    args = parser.parse_args()
+
+    over_budget = []
+    for module, budget in BUDGETS.items():
+        try:
+            times = [import_time(module) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError as e:
+            print(f"{module:<14} failed to import: {e.stderr.strip().splitlines()[-1]}")
+            over_budget.append(module)
+            continue
+        median = statistics.median(times)
+        status = "ok" if median <= budget else "OVER BUDGET"
+        print(f"{module:<14} median {median * 1000:7.1f} ms  min {min(times) * 1000:7.1f} ms  "
+              f"budget {budget * 1000:7.1f} ms  {status}")
+        if median > budget:
+            over_budget.append(module)
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
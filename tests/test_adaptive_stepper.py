@@ -0,0 +1,25 @@
+from base import Daily
+from headless import run_headless
+
+
+def count_calls(max_time_step_size):
+    """
+    :param max_time_step_size: None for the fixed time stepper
+    :return: number of controller calls it takes to run the seeded headless day
+    """
+    controller = Daily(seed=1, max_time_step_size=max_time_step_size)
+    calls = 0
+    handle_sim_step = controller.handle_sim_step
+
+    def counting_handle_sim_step(sim_time, sim_state):
+        nonlocal calls
+        calls += 1
+        handle_sim_step(sim_time, sim_state)
+
+    controller.handle_sim_step = counting_handle_sim_step
+    run_headless(controller)
+    return calls
+
+
+def test_adaptive_stepper_makes_fewer_calls_than_fixed_stepper():
+    assert count_calls(4.0) < count_calls(None)